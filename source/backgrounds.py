@@ -0,0 +1,142 @@
+import queue
+import threading
+
+import cv2
+import numpy as np
+
+from utils import cover_fit, reuse_buffer
+
+
+def orient(frame, dst, scratch=None, mirror=True):
+    # BGR frame scaled to cover dst, converted to RGB and mirrored like the camera frames
+    if mirror:
+        scratch = cover_fit(frame, dst.shape[1], dst.shape[0], dst=reuse_buffer(scratch, dst.shape))
+        cv2.flip(scratch, 1, dst=dst)
+    else:
+        cover_fit(frame, dst.shape[1], dst.shape[0], dst=dst)
+    cv2.cvtColor(dst, cv2.COLOR_BGR2RGB, dst=dst)
+    return scratch
+
+
+class ImageBackground:
+    """A still background, scaled and oriented once per output resolution."""
+
+    def __init__(self, image, mirror=True):
+        self.image = image  # BGR
+        self.mirror = mirror
+        self.frame = None
+
+    def get(self, shape, wait=False):
+        # RGB frame of shape, read-only
+        if self.frame is None or self.frame.shape != tuple(shape):
+            frame = np.empty(shape, np.uint8)
+            orient(self.image, frame, mirror=self.mirror)
+            self.frame = frame
+        return self.frame
+
+    def close(self):
+        pass
+
+
+class VideoBackground:
+    """A looping video background decoded on its own thread.
+
+    The decoder keeps a small ring of frames already scaled to the output resolution and
+    oriented, and waits while it is full, so the video advances by one frame per get. When
+    decoding cannot keep up, get repeats the previous frame instead of stalling the stream.
+    At the end the video is rewound by seeking, and only reopened if the file cannot seek.
+    """
+
+    def __init__(self, path, video=None, capacity=4, mirror=True):
+        self.path = path
+        self.video = cv2.VideoCapture(path) if video is None else video
+        self.mirror = mirror
+        self.shape = None
+        self.shape_changed = threading.Event()
+        self.ready = queue.Queue()
+        self.free = queue.Queue()
+        for _ in range(capacity):
+            self.free.put(None)  # Allocated by the decoder at the requested shape
+        self.frame = None
+        self.running = True
+        self.thread = threading.Thread(target=self.run, name="cow-background", daemon=True)
+        self.thread.start()
+
+    def read(self):
+        ok, frame = self.video.read()
+        if ok:
+            return frame
+        # Rewind, which is seamless for files, and reopen only what cannot seek
+        if self.video.set(cv2.CAP_PROP_POS_FRAMES, 0):
+            ok, frame = self.video.read()
+        if not ok:
+            self.video.release()
+            self.video = cv2.VideoCapture(self.path)
+            ok, frame = self.video.read()
+        return frame if ok else None
+
+    def run(self):
+        scratch = None
+        while self.running:
+            self.shape_changed.wait()
+            try:
+                buffer = self.free.get(timeout=0.5)
+            except queue.Empty:
+                continue
+            frame = self.read()
+            if frame is None:
+                print(f"Could not decode a frame from {self.path}")
+                self.running = False
+                break
+            shape = self.shape
+            buffer = reuse_buffer(buffer, shape)
+            scratch = orient(frame, buffer, scratch, self.mirror)
+            self.ready.put(buffer)
+        self.video.release()
+        self.ready.put(None)
+
+    def get(self, shape, wait=False, timeout=1):
+        # RGB frame of shape, read-only and valid until the next get. With wait, e.g. when processing
+        # offline, the next frame is waited for instead of repeating the previous one.
+        shape = tuple(shape)
+        if shape != self.shape:
+            self.shape = shape
+            self.shape_changed.set()
+        wait = wait or self.frame is None or self.frame.shape != shape
+        while True:
+            try:
+                frame = self.ready.get(timeout=timeout) if wait else self.ready.get_nowait()
+            except queue.Empty:
+                break
+            if frame is None:  # The decoder stopped
+                self.ready.put(None)
+                break
+            if frame.shape != shape:  # Decoded before the resolution changed
+                self.free.put(frame)
+                continue
+            if self.frame is not None:
+                self.free.put(self.frame)
+            self.frame = frame
+            break
+        if self.frame is None or self.frame.shape != shape:
+            return np.zeros(shape, np.uint8)  # Nothing decoded at this resolution yet
+        return self.frame
+
+    def close(self):
+        self.running = False
+        self.shape_changed.set()
+        self.thread.join(timeout=1)
+
+
+def open_background(path, mirror=True):
+    # ImageBackground or VideoBackground for the file at path, None if it cannot be read
+    if path is None:
+        return None
+    image = cv2.imread(path)
+    if image is not None:
+        return ImageBackground(image, mirror)
+    video = cv2.VideoCapture(path)
+    if video.isOpened():
+        return VideoBackground(path, video, mirror=mirror)
+    video.release()
+    return None
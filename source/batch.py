@@ -0,0 +1,158 @@
+"""
+Offline processing of recorded videos with the plugin chain of a saved configuration.
+
+    python batch.py talk.mp4 talk_processed.mp4 --config latest.conf
+
+Decoding, processing and encoding run on their own threads, connected by bounded queues so
+that no frame is dropped. Plugins supporting it, like the segmentation, get the frames in
+batches first and run their network on a whole batch per forward pass. A JSON report with the
+throughput and per-plugin timings is printed at the end.
+"""
+
+import argparse
+import json
+import queue
+import sys
+import threading
+import time
+
+import cv2
+import numpy as np
+
+from main import load_plugins, SEGMENTATION_BACKENDS, set_segmentation_backend
+from plugin import make_chain_process, StripExecutor
+from stats import PipelineStats
+from utils import FramePool, reuse_buffer
+
+
+def split_chain(plugins):
+    # Consecutive segments of the chain, each plugin supporting batches starting a new one
+    segments = []
+    for plugin in plugins:
+        if not segments or plugin.supports_batch():
+            segments.append([])
+        segments[-1].append(plugin)
+    return segments
+
+
+def decode(video, frames, pool):
+    # Mirrored and in RGB, like the camera frames the plugins are made for
+    try:
+        while True:
+            ok, raw = video.read()
+            if not ok:
+                break
+            frame = cv2.flip(raw, 1, dst=pool.acquire_like(raw))
+            frames.put(cv2.cvtColor(frame, cv2.COLOR_BGR2RGB, dst=frame))
+    finally:
+        video.release()
+        frames.put(None)
+
+
+def encode(writer, frames, pool, counts):
+    scratch = None
+    while True:
+        frame = frames.get()
+        if frame is None:
+            break
+        scratch = cv2.flip(frame, 1, dst=reuse_buffer(scratch, frame.shape))  # Mirror back
+        writer.write(cv2.cvtColor(scratch, cv2.COLOR_RGB2BGR, dst=scratch))
+        pool.release(frame)
+        counts["encoded"] += 1
+    writer.release()
+
+
+def process(plugins, frames, results, pool, batch_size=8, stats=None, executor=None):
+    segments = split_chain(plugins)
+    chains = [make_chain_process(segment, pool, stats, executor) for segment in segments]
+    done = False
+    while not done:
+        batch = []
+        while len(batch) < batch_size:
+            frame = frames.get()
+            if frame is None:
+                done = True
+                break
+            batch.append(frame)
+        for segment, chain in zip(segments, chains):
+            first = segment[0]
+            first.update_state()
+            if batch and first.supports_batch() and not first.is_identity():
+                start = time.perf_counter()
+                first.prepare_batch(batch)
+                if stats is not None:
+                    stats.record("batches", first.plugin_name, time.perf_counter() - start)
+            batch = [chain(frame) for frame in batch]
+        for frame in batch:
+            if not pool.owns(frame):
+                # Owned by a plugin, which may write it again while the frame waits for the encoder
+                copy = pool.acquire_like(frame)
+                np.copyto(copy, frame)
+                frame = copy
+            results.put(frame)
+    results.put(None)
+
+
+def run(input_path, output_path, plugins, batch_size=8, fourcc="mp4v", executor=None):
+    video = cv2.VideoCapture(input_path)
+    if not video.isOpened():
+        raise ValueError(f"Could not open {input_path}")
+    fps = video.get(cv2.CAP_PROP_FPS) or 30
+    size = int(video.get(cv2.CAP_PROP_FRAME_WIDTH)), int(video.get(cv2.CAP_PROP_FRAME_HEIGHT))
+    writer = cv2.VideoWriter(output_path, cv2.VideoWriter_fourcc(*fourcc), fps, size)
+    if not writer.isOpened():
+        video.release()
+        raise ValueError(f"Could not write {output_path} with fourcc {fourcc}")
+    pool = FramePool()
+    stats = PipelineStats(window=10000)
+    decoded, processed = queue.Queue(2 * batch_size), queue.Queue(2 * batch_size)
+    counts = {"encoded": 0}
+    workers = [threading.Thread(target=decode, args=(video, decoded, pool), name="cow-decode", daemon=True),
+               threading.Thread(target=encode, args=(writer, processed, pool, counts), name="cow-encode",
+                                daemon=True)]
+    start = time.perf_counter()
+    for worker in workers:
+        worker.start()
+    process(plugins, decoded, processed, pool, batch_size, stats, executor)
+    for worker in workers:
+        worker.join()
+    elapsed = time.perf_counter() - start
+    return {"input": input_path, "output": output_path, "frames": counts["encoded"],
+            "seconds": elapsed, "fps": counts["encoded"] / elapsed if elapsed > 0 else None,
+            "batch_size": batch_size, "plugins": stats.summary().get("plugins", {}),
+            "batches": stats.summary().get("batches", {})}
+
+
+def parse_args(argv):
+    parser = argparse.ArgumentParser(description="Process video files with the plugin chain of a saved configuration.")
+    parser.add_argument("input", help="video file to process")
+    parser.add_argument("output", help="video file to write")
+    parser.add_argument("--config", default=None, help="saved .conf preset to load")
+    parser.add_argument("--block", nargs="*", default=[], help="plugin modules to leave out")
+    parser.add_argument("--batch-size", type=int, default=8,
+                        help="frames per batch for plugins that process batches, like the segmentation")
+    parser.add_argument("--fourcc", default="mp4v", help="codec of the output file")
+    parser.add_argument("--segmentation-backend", choices=SEGMENTATION_BACKENDS, default=None,
+                        help="MODNet inference backend, instead of the one saved in the config")
+    parser.add_argument("--strip-workers", type=int, default=1,
+                        help="threads running per-pixel plugin kernels on horizontal strips")
+    return parser.parse_args(argv)
+
+
+def main(argv=None):
+    args = parse_args(sys.argv[1:] if argv is None else argv)
+    plugins = load_plugins(args.config, args.block)
+    if args.segmentation_backend is not None:
+        set_segmentation_backend(plugins, args.segmentation_backend)
+    executor = StripExecutor(args.strip_workers) if args.strip_workers > 1 else None
+    try:
+        report = run(args.input, args.output, plugins, args.batch_size, args.fourcc, executor)
+    finally:
+        if executor is not None:
+            executor.close()
+    print(json.dumps(report, indent=2))
+    return report
+
+
+if __name__ == "__main__":
+    main()
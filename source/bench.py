@@ -0,0 +1,141 @@
+"""
+Headless pipeline benchmark: feeds synthetic or recorded frames through the plugin chain
+of a saved configuration into a null sink and prints throughput and latency as JSON.
+
+    python bench.py --config latest.conf --resolutions 720p 1080p
+
+--segmentation-backends additionally times the MODNet inference backends on the bundled
+checkpoint at the input sizes the segmentation plugin uses.
+"""
+
+import argparse
+import json
+import sys
+import time
+
+import cv2
+import numpy as np
+
+from main import load_plugins
+from plugin import make_chain_process, StripExecutor
+from stats import PipelineStats
+from utils import FramePool
+
+RESOLUTIONS = {"480p": (640, 480), "720p": (1280, 720), "1080p": (1920, 1080)}
+# MODNet input sizes at segmentation scale factors 2, 3 and 4
+SEGMENTATION_SIZES = [(352, 256), (256, 160), (192, 128)]
+
+
+def synthetic_frames(width, height, count=30, seed=0):
+    # A moving gradient with noise, so that plugins do not see a constant image
+    rng = np.random.RandomState(seed)
+    x = np.linspace(0, 255, width, dtype=np.float32)[None, :]
+    y = np.linspace(0, 255, height, dtype=np.float32)[:, None]
+    frames = []
+    for i in range(count):
+        shift = 255 * i / count
+        frame = np.empty((height, width, 3), np.float32)
+        frame[..., 0] = (x + shift) % 256
+        frame[..., 1] = (y + shift) % 256
+        frame[..., 2] = (x + y) / 2
+        frame += rng.normal(0, 8, frame.shape).astype(np.float32)
+        frames.append(np.clip(frame, 0, 255).astype(np.uint8))
+    return frames
+
+
+def recorded_frames(path, width, height, count=30):
+    # Decoded up front so that decoding is not part of the measurement
+    video = cv2.VideoCapture(path)
+    frames = []
+    while len(frames) < count:
+        ok, frame = video.read()
+        if not ok:
+            break
+        frame = cv2.resize(frame, (width, height), interpolation=cv2.INTER_AREA)
+        frames.append(cv2.cvtColor(frame, cv2.COLOR_BGR2RGB))
+    video.release()
+    if not frames:
+        raise ValueError(f"Could not decode any frame from {path}")
+    return frames
+
+
+def run_benchmark(plugins, frames, num_frames=300, warmup=30, executor=None):
+    pool = FramePool()
+    stats = PipelineStats(window=num_frames)
+    chain = make_chain_process(plugins, pool, stats, executor)
+    latencies = []
+    total = 0
+    for i in range(warmup + num_frames):
+        if i == warmup:
+            stats.reset()
+        source = frames[i % len(frames)]
+        frame = pool.acquire_like(source)
+        np.copyto(frame, source)
+        start = time.perf_counter()
+        out = chain(frame)
+        elapsed = time.perf_counter() - start
+        pool.release(out)  # Null sink
+        if i >= warmup:
+            latencies.append(elapsed * 1000)
+            total += elapsed
+    p50, p95, p99 = np.percentile(latencies, (50, 95, 99))
+    return {"frames": num_frames,
+            "fps": num_frames / total if total > 0 else None,
+            "latency_ms": {"mean": float(np.mean(latencies)), "p50": float(p50), "p95": float(p95),
+                           "p99": float(p99), "max": float(np.max(latencies))},
+            "plugins": stats.summary().get("plugins", {})}
+
+
+def parse_args(argv):
+    parser = argparse.ArgumentParser(description="Benchmark the plugin chain without a webcam or v4l2loopback.")
+    parser.add_argument("--config", default=None, help="saved .conf preset to load")
+    parser.add_argument("--video", default=None, help="video file to take frames from instead of synthetic ones")
+    parser.add_argument("--resolutions", nargs="+", default=list(RESOLUTIONS), choices=list(RESOLUTIONS))
+    parser.add_argument("--frames", type=int, default=300, help="number of measured frames per resolution")
+    parser.add_argument("--warmup", type=int, default=30, help="number of frames run before measuring")
+    parser.add_argument("--strip-workers", type=int, default=1,
+                        help="threads running per-pixel plugin kernels on horizontal strips")
+    parser.add_argument("--block", nargs="*", default=[], help="plugin modules to leave out")
+    parser.add_argument("--segmentation-backends", nargs="*", default=None,
+                        choices=["eager", "torchscript", "onnx"],
+                        help="also benchmark these MODNet inference backends (all if none are given)")
+    parser.add_argument("--segmentation-device", default="cpu", choices=["cpu", "cuda"])
+    parser.add_argument("--output", default=None, help="write the JSON report to this file instead of stdout")
+    return parser.parse_args(argv)
+
+
+def main(argv=None):
+    args = parse_args(sys.argv[1:] if argv is None else argv)
+    plugins = load_plugins(args.config, args.block)
+    executor = StripExecutor(args.strip_workers) if args.strip_workers > 1 else None
+    report = {"config": args.config,
+              "source": args.video or "synthetic",
+              "strip_workers": args.strip_workers,
+              "plugins": [plugin.plugin_name for plugin in plugins],
+              "results": []}
+    for name in args.resolutions:
+        width, height = RESOLUTIONS[name]
+        if args.video:
+            frames = recorded_frames(args.video, width, height)
+        else:
+            frames = synthetic_frames(width, height)
+        result = run_benchmark(plugins, frames, args.frames, args.warmup, executor)
+        report["results"].append(dict(resolution=name, width=width, height=height, **result))
+    if executor is not None:
+        executor.close()
+    if args.segmentation_backends is not None:
+        from plugins.segmentation_plugin.backends import benchmark, BACKENDS
+        images = [synthetic_frames(width, height, count=1)[0] for width, height in SEGMENTATION_SIZES]
+        report["segmentation_backends"] = benchmark(args.segmentation_backends or BACKENDS, images,
+                                                    device=args.segmentation_device)
+    text = json.dumps(report, indent=2)
+    if args.output:
+        with open(args.output, "w") as f:
+            f.write(text + "\n")
+    else:
+        print(text)
+    return report
+
+
+if __name__ == "__main__":
+    main()
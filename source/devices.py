@@ -0,0 +1,110 @@
+import glob
+import os
+import re
+import threading
+from concurrent.futures import ThreadPoolExecutor
+
+import v4l2
+
+# Tried on cameras that report a range of frame sizes instead of a list
+COMMON_RESOLUTIONS = [(1920, 1080), (1280, 720), (800, 600), (640, 480), (320, 240)]
+
+
+def device_path(port):
+    return f"/dev/video{port}"
+
+
+def device_key(port):
+    # udev recreates the device node when a camera is plugged in, so its identity changes on hotplug
+    try:
+        st = os.stat(device_path(port))
+    except OSError:
+        return None
+    return port, st.st_rdev, st.st_ino, st.st_ctime_ns
+
+
+def device_keys():
+    keys = {}
+    for path in glob.glob("/dev/video*"):
+        match = re.fullmatch(r"/dev/video(\d+)", path)
+        if match:
+            keys[int(match.group(1))] = device_key(int(match.group(1)))
+    return keys
+
+
+def fitting_resolutions(size_range):
+    fits = []
+    for w, h in COMMON_RESOLUTIONS:
+        if size_range["min_width"] <= w <= size_range["max_width"] and \
+                size_range["min_height"] <= h <= size_range["max_height"] and \
+                (w - size_range["min_width"]) % max(size_range["step_width"], 1) == 0 and \
+                (h - size_range["min_height"]) % max(size_range["step_height"], 1) == 0:
+            fits.append((w, h))
+    return fits
+
+
+def probe_resolutions(port, formats=("YUYV", "MJPG")):
+    # [(fourcc, width, height)] the camera can capture, largest first, from V4L2 format enumeration.
+    # Raises OSError if the device cannot be queried.
+    fd = os.open(device_path(port), os.O_RDWR | os.O_NONBLOCK)
+    try:
+        if not v4l2.query_capabilities(fd)["device_caps"] & v4l2.V4L2_CAP_VIDEO_CAPTURE:
+            return []
+        supported = v4l2.enum_formats(fd)
+        resolutions = []
+        for fmt in formats:
+            if fmt not in supported:
+                continue
+            sizes = []
+            for size in v4l2.enum_frame_sizes(fd, fmt):
+                if size["type"] == v4l2.V4L2_FRMSIZE_TYPE_DISCRETE:
+                    sizes.append((size["width"], size["height"]))
+                else:
+                    sizes.extend(fitting_resolutions(size))
+            for w, h in sorted(set(sizes), key=lambda s: s[0] * s[1], reverse=True):
+                resolutions.append((fmt, w, h))
+        return resolutions
+    finally:
+        os.close(fd)
+
+
+class CapabilityCache:
+    """Capture resolutions per camera, probed in parallel and cached by device identity.
+
+    A camera is probed again once its device node changed, i.e. after it was unplugged and
+    plugged in again. fallback(port) is used for devices that do not answer the V4L2 queries.
+    """
+
+    def __init__(self, workers=4, fallback=None):
+        self.entries = {}  # port: (device key, resolutions)
+        self.lock = threading.Lock()
+        self.workers = workers
+        self.fallback = fallback
+
+    def get(self, port):
+        key = device_key(port)
+        if key is None:
+            return []
+        with self.lock:
+            entry = self.entries.get(port)
+        if entry is not None and entry[0] == key:
+            return entry[1]
+        try:
+            resolutions = probe_resolutions(port)
+        except OSError as e:
+            print(f"Could not query {device_path(port)}: {e}")
+            resolutions = self.fallback(port) if self.fallback is not None else []
+        with self.lock:
+            self.entries[port] = (key, resolutions)
+        return resolutions
+
+    def probe_all(self, ports):
+        with ThreadPoolExecutor(max_workers=self.workers, thread_name_prefix="cow-probe") as pool:
+            return dict(zip(ports, pool.map(self.get, ports)))
+
+    def invalidate(self, port=None):
+        with self.lock:
+            if port is None:
+                self.entries = {}
+            else:
+                self.entries.pop(port, None)
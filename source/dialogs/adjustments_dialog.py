@@ -0,0 +1,59 @@
+from PyQt5 import QtWidgets, QtCore
+from PyQt5.QtWidgets import QDialog
+
+
+class AdjustmentsDialog(QDialog):
+    def __init__(self, slider_limit, args, **kwargs):
+        super(AdjustmentsDialog, self).__init__(args, **kwargs)
+        self.slider_limit = slider_limit
+        self.setup_ui()
+
+    # noinspection PyAttributeOutsideInit
+    def setup_ui(self):
+        self.setWindowTitle("Image Tuning")
+
+        self.layout = QtWidgets.QGridLayout()
+        self.setLayout(self.layout)
+
+        self.brightness_slider = self.create_adjustment_slider()
+        self.layout.addWidget(self.brightness_slider, 1, 1, 1, 1)
+
+        self.brightness_label = QtWidgets.QLabel()
+        self.brightness_label.setText("Brightness")
+        self.layout.addWidget(self.brightness_label, 1, 0, 1, 1)
+
+        self.saturation_slider = self.create_adjustment_slider()
+        self.layout.addWidget(self.saturation_slider, 3, 1, 1, 1)
+
+        self.contrast_label = QtWidgets.QLabel()
+        self.contrast_label.setText("Contrast")
+        self.layout.addWidget(self.contrast_label, 2, 0, 1, 1)
+
+        self.saturation_label = QtWidgets.QLabel()
+        self.saturation_label.setText("Saturation")
+        self.layout.addWidget(self.saturation_label, 3, 0, 1, 1)
+
+        self.contrast_slider = self.create_adjustment_slider()
+        self.layout.addWidget(self.contrast_slider, 2, 1, 1, 1)
+
+        self.push_button = QtWidgets.QPushButton()
+        self.push_button.setText("Reset")
+        self.push_button.clicked.connect(self.reset_sliders)
+        self.layout.addWidget(self.push_button, 5, 1, 1, 1, QtCore.Qt.AlignRight)
+
+    def reset_sliders(self):
+        self.brightness_slider.setValue(0)
+        self.contrast_slider.setValue(0)
+        self.saturation_slider.setValue(0)
+
+    def create_adjustment_slider(self):
+        slider = QtWidgets.QSlider()
+        slider.setEnabled(True)
+        slider.setMinimum(-self.slider_limit)
+        slider.setMaximum(self.slider_limit)
+        slider.setTracking(True)
+        slider.setOrientation(QtCore.Qt.Horizontal)
+        slider.setTickInterval(self.slider_limit)
+        slider.setTickPosition(QtWidgets.QSlider.TickPosition(2))
+        return slider
+
@@ -0,0 +1,51 @@
+from PyQt5 import QtWidgets, QtCore
+from PyQt5.QtWidgets import QDialog
+
+from dialogs.widgets import create_adjustment_slider
+
+
+class OptionsDialog(QDialog):
+    def __init__(self, args, **kwargs):
+        super(OptionsDialog, self).__init__(args, **kwargs)
+        self.setup_ui()
+
+    # noinspection PyAttributeOutsideInit
+    def setup_ui(self):
+        self.setWindowTitle("Edge Filter Options")
+
+        self.layout = QtWidgets.QGridLayout()
+        self.setLayout(self.layout)
+
+        self.clip_value_slider = create_adjustment_slider(1, 1000, step=50)
+        self.layout.addWidget(self.clip_value_slider, 1, 1, 1, 1)
+        self.label("Clip Value", 1, 0, 1, 1)
+
+        self.kernel_slider = create_adjustment_slider(1, 9, step=2)
+        self.layout.addWidget(self.kernel_slider, 2, 1, 1, 1)
+        self.label("Kernel Size", 2, 0, 1, 1)
+
+        self.threshold_slider = create_adjustment_slider(1, 100, step=5)
+        self.layout.addWidget(self.threshold_slider, 3, 1, 1, 1)
+        self.label("Threshold", 3, 0, 1, 1)
+
+        self.push_button = QtWidgets.QPushButton()
+        self.push_button.setText("Reset")
+        self.push_button.clicked.connect(self.reset_sliders)
+        self.layout.addWidget(self.push_button, 5, 1, 1, 1, QtCore.Qt.AlignRight)
+
+    def label(self, name, *args):
+        label = QtWidgets.QLabel()
+        label.setText(name)
+        self.layout.addWidget(label, *args)
+
+    # noinspection PyAttributeOutsideInit
+    def base_values(self, kernel_value, clip_value, threshold_value):
+        self.kernel_value_0 = kernel_value
+        self.clip_value_0 = clip_value
+        self.threshold_value_0 = threshold_value
+        self.reset_sliders()
+
+    def reset_sliders(self):
+        self.kernel_slider.setValue(self.kernel_value_0)
+        self.clip_value_slider.setValue(self.clip_value_0)
+        self.threshold_slider.setValue(self.threshold_value_0)
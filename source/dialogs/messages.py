@@ -0,0 +1,15 @@
+from PyQt5 import QtWidgets
+from PyQt5.QtWidgets import QMessageBox
+
+
+def show_warning(window, title, text):
+    mbox = QMessageBox(window)
+    mbox.setText(text)
+    mbox.setWindowTitle(title)
+    mbox.setIcon(QMessageBox.Warning)
+    mbox.show()
+
+
+def get_open_file_name(window, caption):
+    file_name, _ = QtWidgets.QFileDialog.getOpenFileName(window, caption, "")
+    return file_name
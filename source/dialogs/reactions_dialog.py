@@ -0,0 +1,83 @@
+import json
+from typing import List
+
+import fuzzyset
+from PIL.ImageQt import ImageQt
+from PyQt5 import QtWidgets, QtCore
+from PyQt5.QtCore import QSize
+from PyQt5.QtGui import QPixmap, QIcon
+from PyQt5.QtWidgets import QDialog, QPushButton
+
+
+class ReactionsDialog(QDialog):
+    def __init__(self, icons, initial_reaction, args, **kwargs):
+        super(ReactionsDialog, self).__init__(args, **kwargs)
+        self.icons = icons
+        self.icons_per_row = 6
+        self.selected_reaction = initial_reaction
+        self.load_metadata()
+        self.selection = list(range(len(self.icons)))
+        self.setup_ui()
+
+    # noinspection PyAttributeOutsideInit
+    def load_metadata(self, rel_sim_cutoff=0.5):
+        self.fuzzy_set = fuzzyset.FuzzySet(gram_size_lower=3, use_levenshtein=False, rel_sim_cutoff=rel_sim_cutoff)
+        self.indexer = {}
+        with open('plugin_data/ReactionsPlugin/openmoji.json', 'r') as f:
+            self.metadata: List[dict] = json.load(f)
+        self.metadata = sorted(self.metadata, key=lambda el: el['hexcode'] + ".png")
+        # self.metadata.insert(0, {'tags': 'none', 'openmoji_tags': '', 'annotation': "", 'hexcode': '0'})
+        for ind, item in enumerate(self.metadata, start=1):
+            # key = f"{item['tags']}".replace(',', '')
+            key = f"{item['tags']} {item['openmoji_tags']} {item['annotation']}".replace(',', '')
+            self.fuzzy_set.add(key)
+            self.indexer[key] = ind
+
+    # noinspection PyAttributeOutsideInit
+    def setup_ui(self):
+        self.setWindowTitle("Emoji")
+
+        self.layout = QtWidgets.QVBoxLayout()
+        self.layout.addWidget(self.create_search_bar())
+        self.scroll_area = QtWidgets.QScrollArea(self)
+        self.scroll_area.setWidgetResizable(True)
+        self.scroll_area_content = QtWidgets.QWidget()
+        self.grid_layout = QtWidgets.QGridLayout(self.scroll_area_content)
+        self.scroll_area.setWidget(self.scroll_area_content)
+        self.scroll_area.setHorizontalScrollBarPolicy(QtCore.Qt.ScrollBarAlwaysOff)
+        self.scroll_area.setVerticalScrollBarPolicy(QtCore.Qt.ScrollBarAlwaysOff)
+        self.layout.addWidget(self.scroll_area)
+        self.setLayout(self.layout)
+        self.set_grid_buttons()
+
+    def set_grid_buttons(self):
+        for i, ind in enumerate(self.selection):
+            button = QPushButton()
+            button.setIcon(QIcon(QPixmap.fromImage(ImageQt(self.icons[ind]))))
+            button.setIconSize(QSize(35, 35))
+            button.setStyleSheet('border: 2px solid gray;')
+            button.clicked.connect(self.button_clicked)
+            self.grid_layout.addWidget(button, i // self.icons_per_row, i % self.icons_per_row)
+
+    # noinspection PyAttributeOutsideInit
+    def create_search_bar(self):
+        self.search_bar = QtWidgets.QLineEdit()
+        self.search_bar.textChanged.connect(self.search_changed)
+        return self.search_bar
+
+    def search_changed(self):
+        query = self.search_bar.text().strip()
+        if len(query) == 0:
+            # indexes = list(range(len(self.icons)))
+            return
+        else:
+            matches = self.fuzzy_set.get(query, default=[])
+            indexes = [self.indexer[match] for score, match in matches]
+        self.selection = [0, *indexes]
+        for i in reversed(range(self.grid_layout.count())):
+            self.grid_layout.itemAt(i).widget().setParent(None)
+        self.set_grid_buttons()
+
+    def button_clicked(self):
+        button = self.sender()
+        self.selected_reaction = self.selection[self.grid_layout.indexOf(button)]
@@ -0,0 +1,27 @@
+from PyQt5 import QtWidgets
+from PyQt5.QtWidgets import QDialog
+
+
+class TextInputDialog(QDialog):
+    def __init__(self, args, **kwargs):
+        super(TextInputDialog, self).__init__(args, **kwargs)
+        self.written_text = ""
+        self.setup_ui()
+
+    # noinspection PyAttributeOutsideInit
+    def setup_ui(self):
+        self.setWindowTitle("Text")
+
+        self.layout = QtWidgets.QVBoxLayout()
+        self.layout.addWidget(self.create_text_input())
+        self.setLayout(self.layout)
+
+    # noinspection PyAttributeOutsideInit
+    def create_text_input(self):
+        self.text_area = QtWidgets.QLineEdit()
+        self.text_area.textChanged.connect(self.text_changed)
+        return self.text_area
+
+    def text_changed(self):
+        text = self.text_area.text().strip()
+        self.written_text = text
@@ -1,32 +1,50 @@
+import argparse
 import os
 import pickle
 import sys
+import threading
 from functools import partial
 from subprocess import Popen, PIPE
 
-import cv2
 from PyQt5.QtCore import *
 from PyQt5.QtGui import QPixmap, QImage
 from PyQt5.QtWidgets import *
 
+from devices import CapabilityCache, device_keys
 from main import VirtualCamera, get_available_resolutions
-from plugin import get_plugin_groups
+from plugin import get_plugin_groups, warm_up_plugins
 from utils import ToggleLink
 
 import qdarkstyle
 
 
+class WindowSignals(QObject):
+    # Emitted from worker threads and delivered on the UI thread
+    cameras_probed = pyqtSignal(object, object)  # (cameras, {port: resolutions})
+    preview_ready = pyqtSignal()
+
+
 class MainWindow(QMainWindow):
 
-    def __init__(self, out_port=20, *args, **kwargs):
+    def __init__(self, out_port=20, warm_up=False, target_fps=None, *args, **kwargs):
         super(MainWindow, self).__init__(*args, **kwargs)
 
         self.video_size = QSize(640, 480)
-        self.capture = None
         self.out_port = out_port
         self.in_port = -1
         self.mirrored_output = True
-        self.virtual_camera = VirtualCamera()
+        # Load the models of all plugins in the background instead of on their first activation
+        self.warm_up = warm_up
+        # Quality is degraded to keep target_fps, None keeps the plugin settings as they are
+        self.virtual_camera = VirtualCamera(target_fps=target_fps)
+        self.capabilities = CapabilityCache(fallback=get_available_resolutions)
+        self.signals = WindowSignals()
+        self.signals.cameras_probed.connect(self.set_cameras)
+        self.signals.preview_ready.connect(self.display_video_stream)
+        self.virtual_camera.preview.on_frame = self.signals.preview_ready.emit
+        self.virtual_camera.sinks.add(self.virtual_camera.preview)
+        self.devices = None
+        self.auto_choose_camera = True
 
         self.central = QWidget()
         self.setCentralWidget(self.central)
@@ -38,17 +56,38 @@ class MainWindow(QMainWindow):
         self.statusBar()
         main_menu = self.menuBar()
         _ = self.create_file_actions(main_menu)
-        camera_menu = main_menu.addMenu('Camera')
-        cams = list(filter(lambda x: x[1] != self.out_port, list_cams())) + [("None", -1)]
-        all_resolutions = [get_available_resolutions(port) for _, port in cams]
-        print(cams)
-        for (name, port), resolutions in zip(cams, all_resolutions):
-            resolutions = get_available_resolutions(port)
-            print(name, resolutions)
-            if len(resolutions) == 0:
-                continue
-
-            sub_menu = camera_menu.addMenu(name)
+        self.camera_menu = main_menu.addMenu('Camera')
+        self.camera_menu.addAction(QAction("Probing cameras...", self, enabled=False))
+        self.refresh_cameras()
+        # Probe again when cameras are plugged in or out
+        self.hotplug_timer = QTimer()
+        self.hotplug_timer.timeout.connect(self.check_hotplug)
+        self.hotplug_timer.start(2000)
+        return main_menu
+
+    def camera_devices(self):
+        devices = device_keys()
+        devices.pop(self.out_port, None)  # Created by the first stream
+        return devices
+
+    def refresh_cameras(self):
+        # Lists and probes the cameras off the UI thread, set_cameras fills in the menu
+        self.devices = self.camera_devices()
+
+        def probe():
+            cams = list(filter(lambda x: x[1] != self.out_port, list_cams()))
+            self.signals.cameras_probed.emit(cams, self.capabilities.probe_all([port for _, port in cams]))
+        threading.Thread(target=probe, name="cow-probe", daemon=True).start()
+
+    def check_hotplug(self):
+        if self.camera_devices() != self.devices:
+            self.refresh_cameras()
+
+    def set_cameras(self, cams, all_resolutions):
+        self.camera_menu.clear()
+        available = [(cam, all_resolutions[cam[1]]) for cam in cams if all_resolutions[cam[1]]]
+        for (name, port), resolutions in available:
+            sub_menu = self.camera_menu.addMenu(name)
             for fmt, w, h in resolutions:
                 action = QAction(f"{fmt}: {w}x{h}", self)
                 action.setStatusTip('Choose this input resolution')
@@ -57,10 +96,11 @@ class MainWindow(QMainWindow):
         # Add None action
         action = QAction("None", self)
         action.triggered.connect(partial(self.choose_camera, ("None", -1), None))
-        camera_menu.addAction(action)
-        if len(cams) > 0:
-            self.choose_camera(cams[0], all_resolutions[0][0])
-        return main_menu
+        self.camera_menu.addAction(action)
+        if self.auto_choose_camera and available:
+            self.auto_choose_camera = False
+            cam, resolutions = available[0]
+            self.choose_camera(cam, resolutions[0])
 
     def create_file_actions(self, main_menu):
         file_menu = main_menu.addMenu("File")
@@ -125,20 +165,15 @@ class MainWindow(QMainWindow):
 
                     plugin_menu.addAction(q_action)
         plugins.sort(key=lambda x: x.z_index)
-        self.virtual_camera.set_mapping(self.plugin_process)
+        self.virtual_camera.set_plugins(plugins)
+        if self.warm_up:
+            warm_up_plugins(plugins)
         return plugins
 
-    def plugin_process(self, frame):
-        out = frame
-        for plugin in self.plugins:
-            out = plugin.process(out)
-        return out
-
     def choose_camera(self, cam, resolution):
         self.release_camera()
         if cam[1] != -1:
-            self.virtual_camera.stop_stream()
-            if valid_camera(cam):
+            if self.capabilities.get(cam[1]):
                 self.setup_camera(cam, resolution)
             else:
                 print("Invalid input camera")
@@ -165,43 +200,42 @@ class MainWindow(QMainWindow):
         self.start_preview()
 
     def start_preview(self):
-        self.capture = cv2.VideoCapture(self.out_port)
-        self.video_size = QSize(*self.virtual_camera.current_resolution)
+        self.video_size = QSize(*self.virtual_camera.output_resolution)
 
         self.image_label.setFixedSize(self.video_size)
         self.central.setFixedSize(self.central.sizeHint())
         self.setFixedSize(self.sizeHint())
 
-        self.capture.set(cv2.CAP_PROP_FRAME_WIDTH, self.video_size.width())
-        self.capture.set(cv2.CAP_PROP_FRAME_HEIGHT, self.video_size.height())
-
-        self.timer = QTimer()
-        self.timer.timeout.connect(self.display_video_stream)
-        self.timer.start(30)
+        self.virtual_camera.preview.paused = self.isMinimized()
 
     def release_camera(self):
-        if self.capture is not None:
-            self.timer.stop()
-            self.capture.release()
-            self.capture = None
-            print("Stopped")
+        self.virtual_camera.preview.paused = True
 
     def display_video_stream(self):
-        """Read frame from camera and repaint QLabel widget.
+        """Take the latest output frame and repaint QLabel widget.
         """
-        _, frame = self.capture.read()
-        frame = cv2.cvtColor(frame, cv2.COLOR_BGR2RGB)
-        if self.mirrored_output:
-            frame = cv2.flip(frame, 1)
-        image = QImage(frame, frame.shape[1], frame.shape[0],
+        preview = self.virtual_camera.preview
+        preview.mirror = self.mirrored_output  # Applies from the next frame
+        frame = preview.take()
+        if frame is None:
+            return
+        # Wraps the preview buffer, which stays untouched until the next take
+        image = QImage(frame.data, frame.shape[1], frame.shape[0],
                        frame.strides[0], QImage.Format_RGB888)
         self.image_label.setPixmap(QPixmap.fromImage(image))
 
+    def changeEvent(self, event):
+        # No preview frames are copied while the window is minimised
+        if event.type() == QEvent.WindowStateChange and self.virtual_camera.loopback is not None:
+            self.virtual_camera.preview.paused = self.isMinimized()
+        super(MainWindow, self).changeEvent(event)
+
     def closeEvent(self, event):
         self.save_configuration(latest=True)
         print("Shutting down")
         self.release_camera()
         self.virtual_camera.stop_stream()
+        self.virtual_camera.sinks.close()
         event.accept()
 
 
@@ -218,20 +252,17 @@ def list_cams():
     return sorted(cams, key=lambda x: x[1])
 
 
-def valid_camera(cam):
-    if cam[1] == -1:
-        return True
-    camera = cv2.VideoCapture(int(cam[1]))
-    if not camera.isOpened():
-        return False
-    else:
-        is_reading, img = camera.read()
-        return is_reading
+def parse_args(argv):
+    parser = argparse.ArgumentParser(description="Customizable Open Webcam")
+    parser.add_argument("--target-fps", type=float, default=None, help="degrade quality to keep this frame rate")
+    # The remaining arguments are left to Qt
+    return parser.parse_known_args(argv)
 
 
 if __name__ == "__main__":
-    app = QApplication(sys.argv)
+    args, qt_args = parse_args(sys.argv[1:])
+    app = QApplication(sys.argv[:1] + qt_args)
     app.setStyleSheet(qdarkstyle.load_stylesheet(qt_api='pyqt5'))
-    win = MainWindow()
+    win = MainWindow(target_fps=args.target_fps)
     win.show()
     sys.exit(app.exec_())
@@ -1,35 +1,184 @@
+import argparse
 import pickle
+import signal
 import sys
 from subprocess import Popen
 
-import pyfakewebcam
 import cv2
 import threading
+import time
 import os
 
-from plugin import get_plugins, make_chain_process
+from plugin import get_manifests, get_plugins, make_chain_process, warm_up_plugins, QualityKnob, StripExecutor
+from process_chain import ProcessChain
+from sinks import LoopbackWriter, MjpegHttpSink, NullSink, PreviewChannel, SharedMemorySink, SinkGroup, VideoFileSink
+from stats import PipelineStats
+from utils import cover_fit, FramePool, FrameRing, reuse_buffer, TimedFrame
+
+# Plugins from this z_index on draw over the picture (reactions, text, ...) or record it, so they
+# run at the output resolution when the rest of the chain runs at a lower render scale
+OVERLAY_Z_INDEX = 100
+# Inference backends of the segmentation plugin, "auto" takes ONNX Runtime on the CPU if it is installed
+SEGMENTATION_BACKENDS = ["auto", "eager", "torchscript", "onnx"]
+
+
+class QualityGovernor:
+    """Keeps the processing time of a frame within the budget of a target frame rate.
+
+    While the smoothed processing time exceeds the budget, quality knobs are degraded one level
+    at a time, lowest priority first. Once there is enough headroom they are restored in the
+    reverse order.
+    """
+
+    def __init__(self, target_fps=30, degrade_after=15, restore_after=90, headroom=0.7, smoothing=0.1):
+        self.budget = 1 / target_fps
+        self.degrade_after = degrade_after
+        self.restore_after = restore_after
+        self.headroom = headroom
+        self.smoothing = smoothing
+        self.knobs = []
+        self.levels = {}
+        self.degraded = []
+        self.average = None
+        self.over_budget = 0
+        self.under_budget = 0
+
+    def set_knobs(self, knobs):
+        self.knobs = sorted(knobs, key=lambda knob: knob.priority)
+        self.levels = {}
+        self.degraded = []
+        for knob in self.knobs:
+            self.set_level(knob, 0)
+        self.average = None
+
+    def set_level(self, knob, level):
+        self.levels[knob.name] = level
+        knob.apply(knob.levels[level])
+        self.average = None  # Measure the new setting from scratch
+        self.over_budget = self.under_budget = 0
+
+    def update(self, seconds):
+        if self.average is None:
+            self.average = seconds
+        else:
+            self.average += self.smoothing * (seconds - self.average)
+        if self.average > self.budget:
+            self.over_budget += 1
+            self.under_budget = 0
+            if self.over_budget >= self.degrade_after:
+                self.degrade()
+        elif self.average < self.headroom * self.budget:
+            self.under_budget += 1
+            self.over_budget = 0
+            if self.under_budget >= self.restore_after:
+                self.restore()
+        else:
+            self.over_budget = self.under_budget = 0
+
+    def degrade(self):
+        for knob in self.knobs:
+            level = self.levels[knob.name]
+            if level + 1 < len(knob.levels):
+                self.set_level(knob, level + 1)
+                self.degraded.append(knob)
+                return True
+        self.over_budget = 0
+        return False
+
+    def restore(self):
+        if not self.degraded:
+            self.under_budget = 0
+            return False
+        knob = self.degraded.pop()
+        self.set_level(knob, self.levels[knob.name] - 1)
+        return True
+
+    def get_levels(self):
+        return {knob.name: knob.levels[self.levels[knob.name]] for knob in self.knobs}
 
 
 class VirtualCamera:
-    def __init__(self, pref_resolution=(1920, 1080)):
-        self.fake_camera = None
+    def __init__(self, pref_resolution=(1920, 1080), output_formats=LoopbackWriter.formats, process_stages=None,
+                 strip_workers=1, target_fps=None):
+        self.loopback = None
+        self.output_formats = output_formats
+        # z_index boundaries at which the chain is split into stages running in parallel, e.g. (0, 100)
+        self.process_stages = process_stages
+        self.process_chain = None
+        self.plugins = []
         self.camera_input = None
+        self.input_lock = threading.Lock()
+        self.in_port = None
+        self.out_port = None
         self.pref_resolution = pref_resolution
-        self.current_resolution = self.pref_resolution
+        self.current_resolution = self.pref_resolution  # Of the input
+        # Fixed while the loopback stays open, frames of other inputs are scaled to it
+        self.output_resolution = None
         self.stop_signal = False
         self._virtual_mapping = lambda x: x
+        self._scaled_mappings = None  # (stages below the overlays, overlays) of the plugins
+        self.threads = []
+        self.capture_ring = None
+        self.frame_pool = FramePool()
+        self.stats = PipelineStats()
+        # Every processed frame goes to all sinks: the loopback device (self.loopback) and any added ones
+        self.sinks = SinkGroup(self.frame_pool.release, self.stats)
+        # Latest output frame for an in-process viewer, a sink once added to self.sinks
+        self.preview = PreviewChannel()
+        # Threads running the per-pixel kernels of plugins on horizontal strips, 1 to disable
+        self.executor = StripExecutor(strip_workers) if strip_workers > 1 else None
+        # Degrades quality knobs of the plugins when processing cannot keep up with target_fps
+        self.governor = QualityGovernor(target_fps) if target_fps else None
+        self.render_scale = 1
+        self.raw_frame = None
+        self.fitted_frame = None
+        self.capture_seq = 0
+        self.last_output_seq = None
+        self.skipped_frames = 0
 
     def start_stream(self, in_port, out_port, resolution):
+        # While streaming to out_port, only the input is switched and the loopback device stays open.
+        # With out_port None, frames only go to the added sinks.
+        if self.loopback is not None and out_port == self.out_port:
+            self.switch_input(in_port, resolution)
+            return
         self.stop_stream()
         self.stop_signal = False
-        self.open_port(out_port)
         self.camera_input = cv2.VideoCapture(in_port)
         self.current_resolution = self.set_resolution(*resolution)
-        self.fake_camera = pyfakewebcam.FakeWebcam(f"/dev/video{out_port}", *self.current_resolution)
+        self.in_port = in_port
+        self.out_port = out_port
+        self.output_resolution = self.current_resolution
+        self.frame_pool.clear()
+        if out_port is None:
+            self.loopback = self.sinks.add(NullSink())
+        else:
+            self.open_port(out_port)
+            self.loopback = self.sinks.add(LoopbackWriter(f"/dev/video{out_port}", *self.output_resolution,
+                                                          self.output_formats))
         self.start_stream_thread()
 
-    def set_resolution(self, fmt, w, h):
-        cap = self.camera_input
+    def switch_input(self, in_port, resolution):
+        # Swaps the camera between two reads of the capture thread. Another camera is opened before
+        # the current one is released, a new resolution of the same camera needs it released first.
+        if in_port != self.in_port:
+            camera_input = cv2.VideoCapture(in_port)
+            current_resolution = self.set_resolution(*resolution, cap=camera_input)
+            with self.input_lock:
+                previous, self.camera_input = self.camera_input, camera_input
+                self.current_resolution = current_resolution
+                self.raw_frame = None
+            previous.release()
+        else:
+            with self.input_lock:
+                self.camera_input.release()
+                self.camera_input = cv2.VideoCapture(in_port)
+                self.current_resolution = self.set_resolution(*resolution)
+                self.raw_frame = None
+        self.in_port = in_port
+
+    def set_resolution(self, fmt, w, h, cap=None):
+        cap = self.camera_input if cap is None else cap
         fourcc = cv2.VideoWriter_fourcc(*fmt)
         cap.set(cv2.CAP_PROP_FOURCC, fourcc)
         cap.set(cv2.CAP_PROP_FRAME_WIDTH, w)
@@ -40,37 +189,206 @@ class VirtualCamera:
 
     def set_mapping(self, f):
         self._virtual_mapping = f
+        self._scaled_mappings = None
+
+    def set_plugins(self, plugins):
+        self.plugins = plugins
+        for plugin in plugins:
+            plugin.stats = self.stats
+        self.set_mapping(make_chain_process(plugins, self.frame_pool, self.stats, self.executor))
+        below = [plugin for plugin in plugins if plugin.z_index < OVERLAY_Z_INDEX]
+        overlays = [plugin for plugin in plugins if plugin.z_index >= OVERLAY_Z_INDEX]
+        self._scaled_mappings = tuple(make_chain_process(part, self.frame_pool, self.stats, self.executor)
+                                      for part in (below, overlays))
+        if self.governor is not None:
+            knobs = [knob for plugin in plugins for knob in plugin.get_quality_knobs()]
+            self.governor.set_knobs(knobs + self.get_quality_knobs())
+
+    def get_quality_knobs(self):
+        return [QualityKnob("Render scale", 30, [1, 0.75, 0.5], self.set_render_scale)]
+
+    def set_render_scale(self, scale):
+        self.render_scale = scale
+
+    def get_stats(self):
+        # Rolling p50/p95/p99 timings in milliseconds per stage and per plugin, plus dropped frame counters
+        summary = self.stats.summary()
+        summary["dropped"] = self.dropped_frames()
+        summary["sequence"] = {"last": self.last_output_seq, "skipped": self.skipped_frames}
+        if self.governor is not None:
+            summary["quality"] = self.governor.get_levels()
+        return summary
+
+    def timed(self, stage, function, *args):
+        start = time.perf_counter()
+        result = function(*args)
+        self.stats.record("stages", stage, time.perf_counter() - start)
+        return result
+
+    def read_frame(self):
+        ok, raw = self.camera_input.read(self.raw_frame)
+        if not ok:
+            return None
+        timestamp = self.capture_timestamp()
+        self.raw_frame = raw
+        width, height = self.output_resolution
+        if raw.shape[:2] != (height, width):  # An input switched to another resolution
+            raw = self.fitted_frame = cover_fit(raw, width, height,
+                                                dst=reuse_buffer(self.fitted_frame, (height, width) + raw.shape[2:]))
+        frame = cv2.flip(raw, 1, dst=self.frame_pool.acquire_like(raw))  # Mirror
+        cv2.cvtColor(frame, cv2.COLOR_BGR2RGB, dst=frame)
+        self.capture_seq += 1
+        return TimedFrame(frame, self.capture_seq, timestamp)
+
+    def capture_timestamp(self):
+        # The V4L2 buffer timestamp (monotonic clock) if the backend reports one, otherwise the read time
+        now = time.monotonic()
+        buffer_time = self.camera_input.get(cv2.CAP_PROP_POS_MSEC) / 1000
+        if 0 < now - buffer_time < 1:
+            return buffer_time
+        return now
+
+    def dispatch(self, timed_frame):
+        # Hands a processed frame to the sinks, which record its latency once written
+        if self.last_output_seq is not None and timed_frame.seq > self.last_output_seq + 1:
+            self.skipped_frames += timed_frame.seq - self.last_output_seq - 1
+        self.last_output_seq = timed_frame.seq
+        self.sinks.put(timed_frame)
+
+    def release_timed(self, timed_frame):
+        self.frame_pool.release(timed_frame.frame)
+
+    def process_frame(self, frame):
+        if self.render_scale < 1 and self._scaled_mappings is not None:
+            processed_frame = self.process_scaled(frame, self.render_scale)
+        else:
+            processed_frame = self._virtual_mapping(frame)
+        out = cv2.flip(processed_frame, 1, dst=self.frame_pool.acquire_like(processed_frame))  # Mirror back
+        self.frame_pool.release(processed_frame)
+        return out
+
+    def process_scaled(self, frame, scale):
+        # Runs the chain below the overlays at a lower internal resolution, scales the result back up
+        # and runs the overlays on it, so they keep drawing and recording at the output resolution
+        below, overlays = self._scaled_mappings
+        height, width = frame.shape[:2]
+        size = (int(width * scale) // 2 * 2, int(height * scale) // 2 * 2)
+        small = cv2.resize(frame, size, dst=self.frame_pool.acquire((size[1], size[0]) + frame.shape[2:]),
+                           interpolation=cv2.INTER_AREA)
+        self.frame_pool.release(frame)
+        processed_small = below(small)
+        processed_frame = cv2.resize(processed_small, (width, height), dst=self.frame_pool.acquire(frame.shape),
+                                     interpolation=cv2.INTER_LINEAR)
+        self.frame_pool.release(processed_small)
+        return overlays(processed_frame)
 
-    def stream_forward(self):
+    def capture_forward(self):
         while not self.stop_signal:
-            self.stream_step()
+            try:
+                with self.input_lock:
+                    frame = self.timed("capture", self.read_frame)
+            except Exception as e:
+                print(e)
+                continue
+            if frame is None:
+                time.sleep(0.01)
+                continue
+            self.capture_ring.put(frame)
+
+    def update_process_chain(self, frame):
+        # (Re)starts the stage processes when the plugins or the frame shape change
+        chain = self.process_chain
+        if chain is not None and chain.plugins is self.plugins and chain.shape == frame.shape:
+            return chain
+        self.process_chain = ProcessChain(self.plugins, frame.shape, self.process_stages, stats=self.stats)
+        if chain is not None:
+            chain.close()
+        return self.process_chain
+
+    def process_forward(self):
+        while not self.stop_signal:
+            timed_frame = self.capture_ring.get(timeout=0.1)
+            if timed_frame is None:
+                continue
+            frame = timed_frame.frame
+            if self.process_stages is not None:
+                self.update_process_chain(frame).submit(frame, tag=timed_frame[1:])
+                self.frame_pool.release(frame)
+                continue
+            start = time.perf_counter()
+            try:
+                processed_frame = self.process_frame(frame)
+            except Exception as e:
+                print(e)  # The chain has released the frame
+                processed_frame = None
+            elapsed = time.perf_counter() - start
+            self.stats.record("stages", "process", elapsed)
+            if self.governor is not None:
+                # Also on errors, which are fast, so that the governor keeps restoring knobs a plugin may fail at
+                self.governor.update(elapsed)
+            if processed_frame is not None:
+                self.dispatch(timed_frame._replace(frame=processed_frame))
+
+    def collect_forward(self):
+        # Takes the frames coming out of the stage processes when the chain runs in parallel
+        while not self.stop_signal:
+            chain = self.process_chain
+            if chain is None:
+                time.sleep(0.01)
+                continue
+            frame = self.frame_pool.acquire(chain.shape)
+            result = chain.collect(frame, timeout=0.1)
+            if result is None:
+                self.frame_pool.release(frame)
+                continue
+            out = cv2.flip(frame, 1, dst=self.frame_pool.acquire(chain.shape))  # Mirror back
+            self.frame_pool.release(frame)
+            self.dispatch(TimedFrame(out, *result[1]))
 
     def stream_step(self):
+        # Runs one frame synchronously, so the output device has a frame before the threads start
         try:
-            _, frame = self.camera_input.read()
-            frame = cv2.cvtColor(frame, cv2.COLOR_BGR2RGB)
-            frame = cv2.flip(frame, 1)  # Mirror
-            processed_frame = self._virtual_mapping(frame)
-            processed_frame = cv2.flip(processed_frame, 1)  # Mirror back
+            timed_frame = self.read_frame()
+            if timed_frame is not None:
+                self.dispatch(timed_frame._replace(frame=self.process_frame(timed_frame.frame)))
         except Exception as e:
             print(e)
-        self.fake_camera.schedule_frame(processed_frame)
+
+    def dropped_frames(self):
+        # Stale frames dropped in front of the processing stages and of every sink
+        return {"capture": self.capture_ring.dropped if self.capture_ring else 0,
+                "stages": self.process_chain.dropped if self.process_chain else 0,
+                "sinks": self.sinks.dropped()}
 
     def start_stream_thread(self):
         self.stream_step()
-        self.thread = threading.Thread(target=self.stream_forward)
-        self.thread.start()
+        self.capture_ring = FrameRing(capacity=1, on_drop=self.release_timed)
+        self.threads = [threading.Thread(target=target, name=name) for target, name in
+                        [(self.capture_forward, "cow-capture"),
+                         (self.process_forward, "cow-process")]]
+        if self.process_stages is not None:
+            self.threads.append(threading.Thread(target=self.collect_forward, name="cow-collect"))
+        for thread in self.threads:
+            thread.start()
 
     def stop_stream(self):
-        if self.fake_camera is not None:
+        if self.loopback is not None:
             self.stop_signal = True
-            self.thread.join()
+            self.capture_ring.close()
+            for thread in self.threads:
+                thread.join()
+            self.threads = []
+            if self.process_chain is not None:
+                self.process_chain.close()
+                self.process_chain = None
             self.camera_input.release()
-            os.close(self.fake_camera._video_device)
-            self.fake_camera = None
+            self.sinks.remove(self.loopback)
+            self.loopback = None
+            self.in_port = self.out_port = None
 
     def open_port(self, port):
-        Popen("sudo -S modprobe -r v4l2loopback".split()).wait()
+        # The module is only loaded when the device is missing, reloading it would detach the
+        # applications using the camera
         if not os.path.exists(f"/dev/video{port}"):
             proc = Popen(
                 f'sudo -S /usr/sbin/modprobe v4l2loopback devices=1 video_nr={port} card_label="cow" exclusive_caps=1'.split())
@@ -101,24 +419,96 @@ def get_available_resolutions(port):
         return []
 
 
-def load_config(v_camera, path):
-    if not os.path.exists(path):
-        print(f"File {path} not found")
-    all_config = pickle.load(open(path, "rb"))
-    plugins = get_plugins([])
-    for plugin in plugins:
-        state = all_config.get(plugin.__class__, None)
-        if state is not None:
-            plugin.load(state)
+def load_plugins(path=None, block_list=()):
+    # Instantiates all plugins, applies the states saved in the config at path and sorts them by z_index
+    plugins = get_plugins(list(block_list))
+    if path is not None:
+        if not os.path.exists(path):
+            print(f"File {path} not found")
+        else:
+            all_config = pickle.load(open(path, "rb"))
+            for plugin in plugins:
+                state = all_config.get(plugin.__class__, None)
+                if state is not None:
+                    plugin.load(state)
     plugins.sort(key=lambda x: x.z_index)
-    v_camera.set_mapping(make_chain_process(plugins))
+    return plugins
 
 
-if __name__ == "__main__":
-    INPUT = 0
-    OUTPUT = 20
+def set_segmentation_backend(plugins, name):
+    # Overrides the inference backend of the segmentation plugin, if it is loaded
+    for plugin in plugins:
+        if hasattr(plugin, "set_backend"):
+            plugin.set_backend(name)
+
 
-    virtual = VirtualCamera()
-    if len(sys.argv) > 1:
-        load_config(virtual, sys.argv[1])
-    virtual.start_stream(INPUT, OUTPUT)
+def load_config(v_camera, path):
+    v_camera.set_plugins(load_plugins(path))
+
+
+def parse_resolution(text):
+    width, height = text.lower().split("x")
+    return int(width), int(height)
+
+
+def parse_args(argv):
+    parser = argparse.ArgumentParser(description="Run the virtual camera headless, without the GUI.")
+    parser.add_argument("--input", type=int, default=0, help="index of the webcam, as in /dev/video<input>")
+    parser.add_argument("--output", type=int, default=20, help="index of the v4l2loopback device")
+    parser.add_argument("--no-loopback", action="store_true", help="only write to the sinks given below")
+    parser.add_argument("--record", default=None, metavar="PATH", help="also encode the output into a video file")
+    parser.add_argument("--mjpeg-port", type=int, default=None,
+                        help="also serve the output as MJPEG over HTTP on this local port")
+    parser.add_argument("--shm-name", default=None, help="also publish the output in shared memory of this name")
+    parser.add_argument("--fourcc", default="MJPG", help="pixel format requested from the webcam")
+    parser.add_argument("--resolution", type=parse_resolution, default=(1280, 720), metavar="WIDTHxHEIGHT",
+                        help="resolution requested from the webcam")
+    parser.add_argument("--config", default=None, help="saved .conf preset to load")
+    parser.add_argument("--output-formats", nargs="+", default=list(LoopbackWriter.formats),
+                        help="pixel formats offered to the loopback device, in order of preference")
+    parser.add_argument("--process-stages", type=int, nargs="*", default=None, metavar="Z_INDEX",
+                        help="z_index boundaries at which the chain is split into parallel stages")
+    parser.add_argument("--strip-workers", type=int, default=1,
+                        help="threads running per-pixel plugin kernels on horizontal strips")
+    parser.add_argument("--target-fps", type=float, default=None, help="degrade quality to keep this frame rate")
+    parser.add_argument("--segmentation-backend", choices=SEGMENTATION_BACKENDS, default=None,
+                        help="MODNet inference backend, instead of the one saved in the config")
+    parser.add_argument("--block", nargs="*", default=[], help="plugin modules to leave out")
+    parser.add_argument("--list-plugins", action="store_true", help="list the plugins without loading them and exit")
+    return parser.parse_args(argv)
+
+
+def main(argv=None):
+    args = parse_args(sys.argv[1:] if argv is None else argv)
+    if args.list_plugins:
+        for manifest in get_manifests(args.block):
+            print(f"{manifest.z_index:>6}  {manifest.group}: {manifest.name} ({manifest.module})")
+        return
+    virtual = VirtualCamera(output_formats=tuple(args.output_formats), process_stages=args.process_stages,
+                            strip_workers=args.strip_workers, target_fps=args.target_fps)
+    plugins = load_plugins(args.config, args.block)
+    if args.segmentation_backend is not None:
+        set_segmentation_backend(plugins, args.segmentation_backend)
+    virtual.set_plugins(plugins)
+    # The models of the plugins enabled by the config load while the stream starts
+    warm_up_plugins([plugin for plugin in plugins if not plugin.is_identity()])
+    virtual.start_stream(args.input, None if args.no_loopback else args.output, (args.fourcc, *args.resolution))
+    width, height = virtual.output_resolution
+    if args.record:
+        virtual.sinks.add(VideoFileSink(args.record, width, height, fps=args.target_fps or 30))
+    if args.mjpeg_port:
+        virtual.sinks.add(MjpegHttpSink(args.mjpeg_port))
+    if args.shm_name:
+        virtual.sinks.add(SharedMemorySink(args.shm_name, width, height))
+
+    stop = threading.Event()
+    for signum in (signal.SIGINT, signal.SIGTERM):
+        signal.signal(signum, lambda *_: stop.set())
+    while not stop.wait(timeout=1):
+        pass
+    virtual.stop_stream()
+    virtual.sinks.close()
+
+
+if __name__ == "__main__":
+    main()
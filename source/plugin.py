@@ -1,10 +1,19 @@
 from typing import List
 
+import ast
 import importlib
 import inspect
+import threading
+import time
+from concurrent.futures import ThreadPoolExecutor
 from pathlib import Path
 from collections import namedtuple
 
+import cv2
+import numpy as np
+
+from utils import reuse_buffer
+
 
 def get_plugin_groups(block_list):
     groups = {}
@@ -13,24 +22,69 @@ def get_plugin_groups(block_list):
     return groups
 
 
-def get_plugins(block_list):
+def get_plugin_modules(block_list):
+    # (module name below plugins, source file) of every plugin
     block = set(block_list + ["plugin", "__pycache__"])
-    plugins = []
-    for plugin_path in Path("plugins").iterdir():
+    modules = []
+    for plugin_path in sorted(Path("plugins").iterdir()):
         module_name = plugin_path.stem
         if module_name in block:
             continue
         if plugin_path.is_dir() and not (plugin_path / f"{module_name}.py").exists():
             continue
         if plugin_path.suffix == ".py":
-            plugin = load_plugin_from_module(module_name)  
-        else:  # directory
-            plugin = load_plugin_from_module(f"{module_name}.{module_name}")
-        plugins.append(plugin)
+            modules.append((module_name, plugin_path))
+        elif plugin_path.is_dir():
+            modules.append((f"{module_name}.{module_name}", plugin_path / f"{module_name}.py"))
+    return modules
 
+
+def get_plugins(block_list):
+    plugins = []
+    for module_name, _ in get_plugin_modules(block_list):
+        try:
+            plugins.append(load_plugin_from_module(module_name))
+        except Exception as e:
+            print(f"Could not load plugin {module_name}: {e}")
     return plugins
 
 
+def read_manifest(module_name, path):
+    # Evaluates the MANIFEST dict literal of a plugin module without importing the module
+    tree = ast.parse(Path(path).read_text(), str(path))
+    for node in tree.body:
+        if isinstance(node, ast.Assign) and any(getattr(target, "id", None) == "MANIFEST" for target in node.targets):
+            manifest = ast.literal_eval(node.value)
+            return PluginManifest(module_name, manifest["name"], manifest["group"],
+                                  manifest.get("z_index", 0), manifest.get("actions", []))
+    return None
+
+
+def get_manifests(block_list):
+    manifests = []
+    for module_name, path in get_plugin_modules(block_list):
+        manifest = read_manifest(module_name, path)
+        if manifest is None:
+            print(f"Plugin {module_name} has no MANIFEST")
+            continue
+        manifests.append(manifest)
+    return sorted(manifests, key=lambda manifest: manifest.z_index)
+
+
+def warm_up_plugins(plugins):
+    # Creates the heavy resources of the plugins on a background thread, so that
+    # activating a plugin later does not stall the stream
+    def run():
+        for plugin in plugins:
+            try:
+                plugin.warm_up()
+            except Exception as e:
+                print(e)
+    thread = threading.Thread(target=run, name="cow-warm-up", daemon=True)
+    thread.start()
+    return thread
+
+
 def load_plugin_from_module(module_name):
     module = importlib.import_module(f"plugins.{module_name}")
     members = inspect.getmembers(module, inspect.isclass)
@@ -44,16 +98,186 @@ def add_plugin(plugin_groups, plugin):
     plugin_groups[plugin.group_name].append(plugin)
 
 
-def make_chain_process(plugins):
+def compile_chain(states):
+    # states: (plugin, is_identity, lut) per plugin. Identity plugins are dropped and
+    # runs of adjacent per-pixel colour maps are fused into a single LUT stage.
+    stages = []
+    for plugin, identity, lut in states:
+        if identity:
+            continue
+        if lut is None:
+            stages.append(plugin)
+        elif stages and isinstance(stages[-1], FusedLutStage):
+            stages[-1] = stages[-1].then(plugin, lut)
+        else:
+            stages.append(FusedLutStage([plugin], lut))
+    return stages
+
+
+class StripExecutor:
+    """Runs per-pixel kernels over horizontal strips of a frame on a thread pool."""
+
+    def __init__(self, workers=4, min_rows=32):
+        self.workers = workers
+        self.min_rows = min_rows
+        self.pool = ThreadPoolExecutor(max_workers=workers, thread_name_prefix="cow-strip") if workers > 1 else None
+
+    def strips(self, height):
+        count = max(1, min(self.workers, height // self.min_rows))
+        bounds = np.linspace(0, height, count + 1).astype(int)
+        return [slice(start, stop) for start, stop in zip(bounds[:-1], bounds[1:])]
+
+    def run(self, kernel, src, dst):
+        strips = self.strips(src.shape[0])
+        if self.pool is None or len(strips) == 1:
+            kernel(src, dst, slice(None))
+            return dst
+        for future in [self.pool.submit(kernel, src, dst, rows) for rows in strips]:
+            future.result()
+        return dst
+
+    def close(self):
+        if self.pool is not None:
+            self.pool.shutdown()
+
+
+class FrameContext:
+    """Images derived from the frame in a chain, each computed once on first use.
+
+    The products are shared between plugins, so they are read-only and only valid during the
+    stage that got them. The chain invalidates them after every stage that ran, as it may have
+    written pixels. alpha, the segmentation matte (uint8, 255 for the person), is kept until a
+    stage that is not known to keep pixels in place (e.g. Mirror or Screen) ran, None after.
+    """
+
+    def __init__(self):
+        self.frame = None
+        self.alpha = None
+        self.products = {}
+        self.buffers = {}
+
+    def reset(self, frame):
+        # Starts a new frame
+        self.alpha = None
+        self.update(frame)
+
+    def update(self, frame, keeps_geometry=True):
+        # The frame after a stage, possibly written in place
+        self.frame = frame
+        self.products.clear()
+        if not keeps_geometry:
+            self.alpha = None
+
+    def buffer(self, key, shape, dtype=np.uint8):
+        self.buffers[key] = reuse_buffer(self.buffers.get(key), shape, dtype)
+        return self.buffers[key]
+
+    def get(self, key, compute):
+        if key not in self.products:
+            self.products[key] = compute()
+        return self.products[key]
+
+    def gray(self):
+        return self.get("gray", lambda: cv2.cvtColor(self.frame, cv2.COLOR_RGB2GRAY,
+                                                     dst=self.buffer("gray", self.frame.shape[:2])))
+
+    def hsv(self):
+        return self.get("hsv", lambda: cv2.cvtColor(self.frame, cv2.COLOR_RGB2HSV,
+                                                    dst=self.buffer("hsv", self.frame.shape)))
+
+    def resized(self, size):
+        # The frame scaled to size (width, height)
+        key = ("resized", size)
+        return self.get(key, lambda: cv2.resize(self.frame, size, dst=self.buffer(key, size[::-1] + self.frame.shape[2:]),
+                                                interpolation=cv2.INTER_LINEAR))
+
+    def pyramid(self, levels=3):
+        # The frame followed by levels - 1 successively halved copies
+        def compute():
+            images = [self.frame]
+            for level in range(1, levels):
+                height, width = images[-1].shape[:2]
+                shape = ((height + 1) // 2, (width + 1) // 2) + self.frame.shape[2:]
+                images.append(cv2.pyrDown(images[-1], dst=self.buffer(("pyramid", level), shape)))
+            return images
+        return self.get(("pyramid", levels), compute)
+
+
+def make_chain_process(plugins, pool=None, stats=None, executor=None):
+    # With a pool, the chain takes ownership of the input frame and ping-pongs between pooled buffers.
+    # When a stage raises, the frame it got is released before the exception propagates.
+    # With stats, the wall time of every stage is recorded under the "plugins" section.
+    # With a StripExecutor (and a pool), the per-pixel kernels of plugins run strip-parallel.
+    # The chain is recompiled whenever a plugin changes whether it is an identity or a colour map.
+    # Plugins implementing process_into share the derived images of a FrameContext.
+    compiled = {"signature": None, "stages": []}
+    context = FrameContext()
+
+    def get_stages():
+        states = []
+        for plugin in plugins:
+            plugin.update_state()
+            identity = plugin.is_identity()
+            states.append((plugin, identity, None if identity else plugin.get_lut()))
+        # Plugins return the same LUT object while their parameters are unchanged
+        signature = tuple((identity, None if lut is None else id(lut)) for _, identity, lut in states)
+        if signature != compiled["signature"]:
+            compiled["stages"] = compile_chain(states)
+            compiled["signature"] = signature
+        return compiled["stages"]
+
+    def run(stage, out):
+        if pool is None:
+            return stage.process(out)
+        if not stage.supports_process_into():
+            result = stage.process(out)
+            # A new frame, as process usually returns, leaves the pooled one unused
+            if result is not out and not np.may_share_memory(result, out):
+                pool.release(out)
+            return result
+        dst = pool.acquire_like(out)
+        try:
+            kernel = stage.prepare_kernel(out, context) if executor is not None else None
+            if kernel is not None:
+                result = executor.run(kernel, out, dst)
+            else:
+                result = stage.process_into(out, dst, context)
+        except Exception:
+            pool.release(dst)
+            raise
+        if result is not out:
+            pool.release(out)
+        if result is not dst:
+            pool.release(dst)
+        return result
+
     def chained(frame):
         out = frame
-        for plugin in plugins:
-            out = plugin.process(out)
+        context.reset(frame)
+        try:
+            for stage in get_stages():
+                if stats is None:
+                    out = run(stage, out)
+                else:
+                    start = time.perf_counter()
+                    out = run(stage, out)
+                    stats.record("plugins", stage.plugin_name, time.perf_counter() - start)
+                context.update(out, stage.keeps_geometry)
+        except Exception:
+            # The frame the failing stage got is the only one still held, the caller gets nothing back
+            if pool is not None:
+                pool.release(out)
+            raise
         return out
     return chained
 
 
 PluginAction = namedtuple('PluginAction', ['name', 'function', 'toggle'])
+# What a plugin module declares in its MANIFEST dict literal, readable without importing the module
+PluginManifest = namedtuple('PluginManifest', ['module', 'name', 'group', 'z_index', 'actions'])
+# A setting that trades quality for speed. levels are ordered from best to cheapest, apply(level value)
+# switches to one of them and knobs with a lower priority are degraded first.
+QualityKnob = namedtuple('QualityKnob', ['name', 'priority', 'levels', 'apply'])
 
 
 class Plugin:
@@ -61,6 +285,12 @@ class Plugin:
         self.group_name = group_name
         self.plugin_name = plugin_name
         self.z_index = z_index
+        self.stats = None  # PipelineStats of the camera running this plugin, if any
+        # Whether the plugin can run in another process from a copy rebuilt with get_state/load
+        self.multiprocess_safe = True
+        # Whether every pixel of the output is where it was in the input (colour changes, overlays),
+        # so that the segmentation matte of the chain still lines up after the plugin
+        self.keeps_geometry = False
 
     def get_actions(self) -> List[PluginAction]:
         raise NotImplementedError()
@@ -68,11 +298,86 @@ class Plugin:
     def process(self, frame):
         return frame
 
+    def process_into(self, src, dst, context=None):
+        # Optional in-place contract: write the result into dst (preallocated, same shape as src)
+        # and return it, or return src if it was modified in place. context is the FrameContext of
+        # src when run by a chain.
+        return self.process(src)
+
+    def supports_process_into(self):
+        return type(self).process_into is not Plugin.process_into
+
+    def prepare_kernel(self, src, context=None):
+        # Optional per-pixel form of process_into for strip-parallel execution: does the frame-wide
+        # work and returns kernel(src, dst, rows) writing dst[rows] from src[rows] (or None)
+        return None
+
+    def supports_batch(self):
+        return type(self).prepare_batch is not Plugin.prepare_batch
+
+    def prepare_batch(self, frames):
+        # Optional for offline processing: called with the next frames, as the plugin will get them,
+        # before they are processed one by one, e.g. to run a network on all of them at once
+        pass
+
+    def warm_up(self):
+        # Creates heavy resources (models, image sets) that are otherwise created on first activation.
+        # May be called from a background thread and more than once.
+        pass
+
+    def update_state(self):
+        # Pulls pending option changes (e.g. from dialogs) before the chain inspects the plugin
+        pass
+
+    def is_identity(self):
+        # True if process would currently return the frame unchanged and has no side effects
+        return False
+
+    def get_lut(self):
+        # A (256, 1, 3) uint8 table if process is currently a per-channel colour map, else None.
+        # Return the same object for as long as the mapping does not change.
+        return None
+
     def save(self):
         # Returns an object that stores all customized options
         # It can be any serializable object
         return {}
 
+    def get_quality_knobs(self) -> List[QualityKnob]:
+        return []
+
+    def get_state(self):
+        # Like save, but without side effects such as stopping an ongoing recording
+        return self.save()
+
     def load(self, plugin_state):
         # Loads a previously saved state
-        pass
\ No newline at end of file
+        pass
+
+
+class FusedLutStage(Plugin):
+    """Adjacent per-pixel colour maps of a chain applied as a single LUT pass."""
+
+    def __init__(self, plugins, lut):
+        super().__init__(" + ".join(p.plugin_name for p in plugins), "Chain")
+        self.plugins = plugins
+        self.lut = lut
+        self.keeps_geometry = True
+
+    def then(self, plugin, lut):
+        fused = np.stack([lut[self.lut[:, 0, c], 0, c] for c in range(3)], axis=-1)[:, None, :]
+        return FusedLutStage(self.plugins + [plugin], fused)
+
+    def get_actions(self):
+        return []
+
+    def process(self, frame):
+        return cv2.LUT(frame, self.lut)
+
+    def process_into(self, src, dst, context=None):
+        return cv2.LUT(src, self.lut, dst=dst)
+
+    def prepare_kernel(self, src, context=None):
+        def kernel(src, dst, rows):
+            cv2.LUT(src[rows], self.lut, dst=dst[rows])
+        return kernel
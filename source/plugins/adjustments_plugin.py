@@ -1,25 +1,33 @@
 from plugin import Plugin, PluginAction
+from utils import reuse_buffer
 import numpy as np
 import cv2
 
-from PyQt5 import QtWidgets, QtCore
-from PyQt5.QtWidgets import QDialog
+MANIFEST = {"name": "Adjustments", "group": "Misc", "z_index": 0,
+            "actions": ["Image Tuning"]}
 
 
 class AdjustmentsPlugin(Plugin):
     def __init__(self, slider_limit=100):
-        super().__init__("Adjustments", "Misc")
-        self.dlg: AdjustmentsDialog = None
+        super().__init__(MANIFEST["name"], MANIFEST["group"], MANIFEST["z_index"])
+        self.keeps_geometry = True
+        self.dlg = None
         self.slider_limit = slider_limit
         self.brightness = 0
         self.contrast = 0
         self.saturation = 0
+        self.hsv = None
+        self.lut = None
+        self.lut_params = None
+        self.saturation_lut = None
+        self.lut_saturation = None
 
     def get_actions(self):
         return [PluginAction("Image Tuning", self.show_dialog, False)]
 
     def show_dialog(self, window):
         if not self.dlg:
+            from dialogs.adjustments_dialog import AdjustmentsDialog
             self.dlg = AdjustmentsDialog(self.slider_limit, window)
             self.set_sliders()
         if self.dlg.isHidden():
@@ -32,21 +40,68 @@ class AdjustmentsPlugin(Plugin):
             self.dlg.show()
 
     def process(self, frame):
+        return self.process_into(frame, np.empty_like(frame))
+
+    def process_into(self, src, dst, context=None):
+        self.prepare_kernel(src, context)(src, dst, slice(None))
+        return dst
+
+    def prepare_kernel(self, src, context=None):
+        self.update_state()
+        contrast_lut = self.get_contrast_lut()
+        if self.saturation == 0:
+            def kernel(src, dst, rows):
+                cv2.LUT(src[rows], contrast_lut, dst=dst[rows])
+            return kernel
+        saturation_lut = self.get_saturation_lut()
+        hsv = self.hsv = reuse_buffer(self.hsv, src.shape)
+        if context is not None and self.brightness == 0 and self.contrast == 0:
+            src_hsv = context.hsv()  # Contrast is an identity, so saturation applies to src directly
+
+            def kernel(src, dst, rows):
+                cv2.LUT(src_hsv[rows], saturation_lut, dst=hsv[rows])
+                cv2.cvtColor(hsv[rows], cv2.COLOR_HSV2RGB, dst=dst[rows])
+            return kernel
+
+        def kernel(src, dst, rows):
+            cv2.LUT(src[rows], contrast_lut, dst=dst[rows])
+            cv2.cvtColor(dst[rows], cv2.COLOR_RGB2HSV, dst=hsv[rows])
+            cv2.LUT(hsv[rows], saturation_lut, dst=hsv[rows])
+            cv2.cvtColor(hsv[rows], cv2.COLOR_HSV2RGB, dst=dst[rows])
+        return kernel
+
+    def update_state(self):
         if self.dlg:
             self.get_sliders()
-        frame = frame.astype(np.int)
-        delta_contrast = (self.contrast + self.slider_limit) / self.slider_limit
-        frame = delta_contrast * frame + self.brightness
-        frame = np.clip(frame, 0, 255).astype(np.uint8)
-        frame = cv2.cvtColor(frame, cv2.COLOR_RGB2HSV)
-        frame[:, :, 1] = (frame[:, :, 1].astype(np.int) + self.saturation).clip(0, 255).astype(np.uint8)
-        frame = cv2.cvtColor(frame, cv2.COLOR_HSV2RGB)
-        return frame
+
+    def is_identity(self):
+        return self.brightness == 0 and self.contrast == 0 and self.saturation == 0
+
+    def get_lut(self):
+        # Saturation is not a per-channel map, so the plugin can only be fused without it
+        if self.saturation != 0:
+            return None
+        return self.get_contrast_lut()
+
+    def get_contrast_lut(self):
+        if self.lut_params != (self.brightness, self.contrast):
+            delta_contrast = (self.contrast + self.slider_limit) / self.slider_limit
+            values = np.clip(delta_contrast * np.arange(256) + self.brightness, 0, 255).astype(np.uint8)
+            self.lut = np.repeat(values[:, None, None], 3, axis=2)
+            self.lut_params = (self.brightness, self.contrast)
+        return self.lut
+
+    def get_saturation_lut(self):
+        # Shifts only the S channel of an HSV image
+        if self.lut_saturation != self.saturation:
+            identity = np.arange(256)
+            shifted = np.clip(identity + self.saturation, 0, 255)
+            self.saturation_lut = np.dstack([identity, shifted, identity]).astype(np.uint8)
+            self.lut_saturation = self.saturation
+        return self.saturation_lut
 
     def save(self):
-        if not self.dlg:
-            return {}
-        self.get_sliders()
+        self.update_state()
         return {"brightness": self.brightness,
                 "contrast": self.contrast,
                 "saturation": self.saturation}
@@ -67,60 +122,3 @@ class AdjustmentsPlugin(Plugin):
         self.brightness = self.dlg.brightness_slider.value()
         self.contrast = self.dlg.contrast_slider.value()
         self.saturation = self.dlg.saturation_slider.value()
-
-
-class AdjustmentsDialog(QDialog):
-    def __init__(self, slider_limit, args, **kwargs):
-        super(AdjustmentsDialog, self).__init__(args, **kwargs)
-        self.slider_limit = slider_limit
-        self.setup_ui()
-
-    # noinspection PyAttributeOutsideInit
-    def setup_ui(self):
-        self.setWindowTitle("Image Tuning")
-
-        self.layout = QtWidgets.QGridLayout()
-        self.setLayout(self.layout)
-
-        self.brightness_slider = self.create_adjustment_slider()
-        self.layout.addWidget(self.brightness_slider, 1, 1, 1, 1)
-
-        self.brightness_label = QtWidgets.QLabel()
-        self.brightness_label.setText("Brightness")
-        self.layout.addWidget(self.brightness_label, 1, 0, 1, 1)
-
-        self.saturation_slider = self.create_adjustment_slider()
-        self.layout.addWidget(self.saturation_slider, 3, 1, 1, 1)
-
-        self.contrast_label = QtWidgets.QLabel()
-        self.contrast_label.setText("Contrast")
-        self.layout.addWidget(self.contrast_label, 2, 0, 1, 1)
-
-        self.saturation_label = QtWidgets.QLabel()
-        self.saturation_label.setText("Saturation")
-        self.layout.addWidget(self.saturation_label, 3, 0, 1, 1)
-
-        self.contrast_slider = self.create_adjustment_slider()
-        self.layout.addWidget(self.contrast_slider, 2, 1, 1, 1)
-
-        self.push_button = QtWidgets.QPushButton()
-        self.push_button.setText("Reset")
-        self.push_button.clicked.connect(self.reset_sliders)
-        self.layout.addWidget(self.push_button, 5, 1, 1, 1, QtCore.Qt.AlignRight)
-
-    def reset_sliders(self):
-        self.brightness_slider.setValue(0)
-        self.contrast_slider.setValue(0)
-        self.saturation_slider.setValue(0)
-
-    def create_adjustment_slider(self):
-        slider = QtWidgets.QSlider()
-        slider.setEnabled(True)
-        slider.setMinimum(-self.slider_limit)
-        slider.setMaximum(self.slider_limit)
-        slider.setTracking(True)
-        slider.setOrientation(QtCore.Qt.Horizontal)
-        slider.setTickInterval(self.slider_limit)
-        slider.setTickPosition(QtWidgets.QSlider.TickPosition(2))
-        return slider
-
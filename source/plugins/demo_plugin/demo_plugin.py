@@ -1,16 +1,23 @@
 from plugin import Plugin, PluginAction
-from PyQt5.QtWidgets import QDialog
 import numpy as np
 from . import helper
 
+MANIFEST = {"name": "Demo", "group": "Misc", "z_index": 0,
+            "actions": ["Echo"]}
+
+
 class DemoPlugin(Plugin):
     def __init__(self):
-        super().__init__("Demo", "Misc")
+        super().__init__(MANIFEST["name"], MANIFEST["group"], MANIFEST["z_index"])
+        self.keeps_geometry = True
+        self.lut = None
 
     def get_actions(self):
         return [PluginAction("Echo", self.template_function, False)]
 
     def template_function(self, window):
+        # Qt is only imported by UI actions, so that plugins load in the headless daemon
+        from PyQt5.QtWidgets import QDialog
         dlg = QDialog(window)
         dlg.setWindowTitle(self.plugin_name + " " + helper.greeting_message)
         dlg.exec_()
@@ -18,3 +25,9 @@ class DemoPlugin(Plugin):
     def process(self, frame):
         return (frame * 0.99).astype(np.uint8)
 
+    def get_lut(self):
+        if self.lut is None:
+            values = (np.arange(256) * 0.99).astype(np.uint8)
+            self.lut = np.repeat(values[:, None, None], 3, axis=2)
+        return self.lut
+
@@ -1,24 +1,27 @@
-from typing import Optional
-
 import cv2
 import numpy as np
-from PyQt5.QtWidgets import QDialog
-from PyQt5 import QtWidgets, QtCore
 
-from plugin import Plugin, PluginAction
+from plugin import Plugin, PluginAction, QualityKnob
+
+from utils import ToggleLink, reuse_buffer
 
-from utils import ToggleLink, create_adjustment_slider
+MANIFEST = {"name": "Edge Filter", "group": "Video Filters", "z_index": 0,
+            "actions": ["Activate Filter", "Options"]}
 
 
 class EdgeFilterPlugin(Plugin):
     def __init__(self):
-        super().__init__("Edge Filter", "Video Filters", z_index=0)
-        self.dlg: Optional[OptionsDialog] = None
+        super().__init__(MANIFEST["name"], MANIFEST["group"], MANIFEST["z_index"])
+        self.keeps_geometry = True
+        self.dlg = None
         self.display = ToggleLink()
         self.binary_output = True
         self.threshold = 0.55
         self.clip_value = 500  # Clip for gradient stability
         self.kernel_size = 5
+        self.max_kernel_size = None  # Set by the quality governor
+        self.gray = None
+        self.laplacian = None
 
     def get_actions(self):
         return [PluginAction("Activate Filter", self.toggle_display, self.display),
@@ -26,6 +29,7 @@ class EdgeFilterPlugin(Plugin):
 
     def show_dialog(self, window):
         if not self.dlg:
+            from dialogs.edge_filter_dialog import OptionsDialog
             self.dlg = OptionsDialog(window)
             self.set_sliders()
         if self.dlg.isHidden():
@@ -49,76 +53,60 @@ class EdgeFilterPlugin(Plugin):
         self.display.flip()
 
     def process(self, frame):
-        if self.display.get():
-            if self.dlg:
-                self.get_sliders()
-            frame = self.apply_filter(frame)
-        return frame
-
-    def apply_filter(self, frame):
-        gray = cv2.cvtColor(frame, cv2.COLOR_RGB2GRAY)
-        gray = cv2.blur(gray, ksize=(self.kernel_size, self.kernel_size))  # Additional blurring
-
-        laplacian = cv2.Laplacian(gray, cv2.CV_64F, ksize=self.kernel_size)
-        laplacian = np.clip(laplacian, a_min=-self.clip_value, a_max=self.clip_value)
+        return self.process_into(frame, np.empty_like(frame))
 
-        mini, maxi = np.min(laplacian), np.max(laplacian)
-        normalized = (laplacian - mini) / (maxi - mini + 1e-8)
+    def process_into(self, src, dst, context=None):
+        if self.display.get():
+            self.update_state()
+            return self.apply_filter(src, dst, context)
+        return src
+
+    def update_state(self):
+        if self.dlg:
+            self.get_sliders()
+
+    def is_identity(self):
+        return not self.display.get()
+
+    def get_quality_knobs(self):
+        return [QualityKnob("Edge filter kernel", 15, [None, 3, 1], self.set_max_kernel_size)]
+
+    def set_max_kernel_size(self, size):
+        self.max_kernel_size = size
+
+    def apply_filter(self, frame, dst, context=None):
+        shape = frame.shape[:2]
+        kernel_size = self.kernel_size
+        if self.max_kernel_size is not None:
+            kernel_size = min(kernel_size, self.max_kernel_size)
+        self.gray = reuse_buffer(self.gray, shape)
+        gray = context.gray() if context is not None else cv2.cvtColor(frame, cv2.COLOR_RGB2GRAY, dst=self.gray)
+        cv2.blur(gray, ksize=(kernel_size, kernel_size), dst=self.gray)  # Additional blurring
+
+        self.laplacian = cv2.Laplacian(self.gray, cv2.CV_32F, dst=reuse_buffer(self.laplacian, shape, np.float32),
+                                       ksize=kernel_size)
+        np.clip(self.laplacian, -self.clip_value, self.clip_value, out=self.laplacian)
+
+        mini, maxi = cv2.minMaxLoc(self.laplacian)[:2]
+        scale = 1 / (maxi - mini + 1e-8)
         if self.binary_output:
-            normalized = normalized > self.threshold
-        result = (normalized * 255).astype(np.uint8)
-        result = np.repeat(result[:, :, None], repeats=3, axis=2)  # Expand to color channel
-        return result
+            cv2.threshold(self.laplacian, mini + self.threshold / scale, 255, cv2.THRESH_BINARY, dst=self.laplacian)
+            cv2.convertScaleAbs(self.laplacian, dst=self.gray)
+        else:
+            cv2.convertScaleAbs(self.laplacian, dst=self.gray, alpha=255 * scale, beta=-255 * mini * scale)
+        return cv2.cvtColor(self.gray, cv2.COLOR_GRAY2RGB, dst=dst)  # Expand to color channel
 
     def save(self):
-        return {"display": self.display.get()}
+        self.update_state()
+        return {"display": self.display.get(),
+                "kernel_size": self.kernel_size,
+                "clip_value": self.clip_value,
+                "threshold": self.threshold}
 
     def load(self, plugin_state):
         self.display.set(plugin_state.get("display", False))
-
-
-class OptionsDialog(QDialog):
-    def __init__(self, args, **kwargs):
-        super(OptionsDialog, self).__init__(args, **kwargs)
-        self.setup_ui()
-
-    # noinspection PyAttributeOutsideInit
-    def setup_ui(self):
-        self.setWindowTitle("Edge Filter Options")
-
-        self.layout = QtWidgets.QGridLayout()
-        self.setLayout(self.layout)
-
-        self.clip_value_slider = create_adjustment_slider(1, 1000, step=50)
-        self.layout.addWidget(self.clip_value_slider, 1, 1, 1, 1)
-        self.label("Clip Value", 1, 0, 1, 1)
-
-        self.kernel_slider = create_adjustment_slider(1, 9, step=2)
-        self.layout.addWidget(self.kernel_slider, 2, 1, 1, 1)
-        self.label("Kernel Size", 2, 0, 1, 1)
-
-        self.threshold_slider = create_adjustment_slider(1, 100, step=5)
-        self.layout.addWidget(self.threshold_slider, 3, 1, 1, 1)
-        self.label("Threshold", 3, 0, 1, 1)
-
-        self.push_button = QtWidgets.QPushButton()
-        self.push_button.setText("Reset")
-        self.push_button.clicked.connect(self.reset_sliders)
-        self.layout.addWidget(self.push_button, 5, 1, 1, 1, QtCore.Qt.AlignRight)
-
-    def label(self, name, *args):
-        label = QtWidgets.QLabel()
-        label.setText(name)
-        self.layout.addWidget(label, *args)
-
-    # noinspection PyAttributeOutsideInit
-    def base_values(self, kernel_value, clip_value, threshold_value):
-        self.kernel_value_0 = kernel_value
-        self.clip_value_0 = clip_value
-        self.threshold_value_0 = threshold_value
-        self.reset_sliders()
-
-    def reset_sliders(self):
-        self.kernel_slider.setValue(self.kernel_value_0)
-        self.clip_value_slider.setValue(self.clip_value_0)
-        self.threshold_slider.setValue(self.threshold_value_0)
+        self.kernel_size = plugin_state.get("kernel_size", self.kernel_size)
+        self.clip_value = plugin_state.get("clip_value", self.clip_value)
+        self.threshold = plugin_state.get("threshold", self.threshold)
+        if self.dlg:
+            self.set_sliders()
@@ -5,45 +5,75 @@ import time
 
 from utils import ToggleLink
 
+MANIFEST = {"name": "FPS", "group": "Misc", "z_index": 1000,
+            "actions": ["Display FPS", "Display timings"]}
+
 
 class FPSPlugin(Plugin):
     def __init__(self):
-        super().__init__("FPS", "Misc", z_index=1000)
+        super().__init__(MANIFEST["name"], MANIFEST["group"], MANIFEST["z_index"])
+        self.keeps_geometry = True
         self.display = ToggleLink()
+        self.display_timings = ToggleLink()
         self.counter = 0
         self.last_time = time.time()
         self.update_time = 1
         self.fps = "?"
+        self.timings = []
+        self.multiprocess_safe = False  # Reads the pipeline stats of this process
 
     def get_actions(self):
-        return [PluginAction("Display FPS", self.toggle_display, self.display)]
+        return [PluginAction("Display FPS", self.toggle_display, self.display),
+                PluginAction("Display timings", self.toggle_timings, self.display_timings)]
 
     def toggle_display(self, window):
         self.display.flip()
 
+    def toggle_timings(self, window):
+        self.display_timings.flip()
+
     def process(self, frame):
         if self.display.get():
-            frame = self.write_fps(frame)
+            frame = self.write_lines(frame, [self.fps])
+        if self.display_timings.get():
+            frame = self.write_lines(frame, self.timings, first_line=1)
         self.counter += 1
         current = time.time()
         if current - self.last_time > self.update_time:
             self.fps = "{0:.2f} fps".format(self.counter / (current - self.last_time))
             self.last_time = current
             self.counter = 0
+            if self.display_timings.get():
+                self.timings = self.format_timings()
 
         return frame
 
-    def write_fps(self, frame):
+    def format_timings(self):
+        # One "name p50/p95/p99 ms" line per pipeline stage and plugin
+        if self.stats is None:
+            return ["No timings available"]
+        lines = []
+        for section in self.stats.summary().values():
+            for name, timing in section.items():
+                if timing["p50"] is not None:
+                    lines.append("{0}: {1:.1f}/{2:.1f}/{3:.1f} ms".format(
+                        name, timing["p50"], timing["p95"], timing["p99"]))
+        return lines
+
+    def write_lines(self, frame, lines, first_line=0):
         font = cv2.FONT_HERSHEY_SIMPLEX
-        xy = (10, 30)
         font_scale = 0.6
         font_color = (255, 255, 255)
         line_type = 2
-        frame = cv2.putText(frame, self.fps, xy, font, font_scale, font_color, lineType=line_type)
+        for i, line in enumerate(lines, first_line):
+            xy = (10, 30 + 22 * i)
+            frame = cv2.putText(frame, line, xy, font, font_scale, font_color, lineType=line_type)
         return frame
 
     def save(self):
-        return {"display": self.display.get()}
+        return {"display": self.display.get(),
+                "display_timings": self.display_timings.get()}
 
     def load(self, plugin_state):
         self.display.set(plugin_state.get("display", False))
+        self.display_timings.set(plugin_state.get("display_timings", False))
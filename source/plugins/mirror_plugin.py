@@ -4,10 +4,13 @@ from plugin import Plugin, PluginAction
 
 from utils import ToggleLink
 
+MANIFEST = {"name": "Mirror", "group": "High Level", "z_index": 10000,
+            "actions": ["Mirror diplay"]}
+
 
 class MirrorPlugin(Plugin):
     def __init__(self):
-        super().__init__("Mirror", "High Level", z_index=10000)
+        super().__init__(MANIFEST["name"], MANIFEST["group"], MANIFEST["z_index"])
         self.display = ToggleLink()
 
     def get_actions(self):
@@ -23,6 +26,14 @@ class MirrorPlugin(Plugin):
 
         return frame
 
+    def process_into(self, src, dst, context=None):
+        if self.display.get():
+            return cv2.flip(src, 1, dst=dst)
+        return src
+
+    def is_identity(self):
+        return not self.display.get()
+
     def save(self):
         return {"display": self.display.get()}
 
@@ -1,20 +1,23 @@
 import os
 import PIL
-import cv2
 import numpy as np
 
 from pathlib import Path
 from datetime import datetime
-from PyQt5 import QtWidgets
 
 from plugin import Plugin, PluginAction
-from utils import ToggleLink
+from sinks import VideoFileSink
+from utils import ToggleLink, TimedFrame
 from PIL import Image
 
+MANIFEST = {"name": "Record", "group": "High Level", "z_index": 1000,
+            "actions": ["Record"]}
+
 
 class RecordPlugin(Plugin):
     def __init__(self):
-        super().__init__("Record", "High Level", z_index=1000)
+        super().__init__(MANIFEST["name"], MANIFEST["group"], MANIFEST["z_index"])
+        self.keeps_geometry = True
         self.record = ToggleLink()
         self.path = Path('plugin_data/RecordPlugin')
         os.makedirs(self.path, exist_ok=True)
@@ -24,6 +27,8 @@ class RecordPlugin(Plugin):
         self.record_path = None
         self.image_size = None  # (height, width)
         self.writer = None
+        self.frame_count = 0
+        self.multiprocess_safe = False  # Recording is toggled from the window
 
     def load_icon(self):
         img = Image.open('plugins/record_plugin/record_icon.png')
@@ -33,10 +38,15 @@ class RecordPlugin(Plugin):
     def start_recording(self):
         now = datetime.now()
         self.record_path = self.path / now.strftime("%Y-%m-%d_%H-%M-%S.mp4")
-        self.writer= cv2.VideoWriter(str(self.record_path), cv2.VideoWriter_fourcc(*'MP4V'), 30, self.image_size[::-1])
+        # Frames are mirrored back and encoded on the thread of the sink
+        self.writer = VideoFileSink(self.record_path, *self.image_size[::-1], fps=30, fourcc='MP4V', mirror=True)
+        self.writer.name = "record"  # Kept apart from the stats of the --record sink of main.py
+        self.frame_count = 0
+        self.writer.start(stats=self.stats)
 
     def stop_recording(self):
-        self.writer.release()
+        self.writer.stop()
+        self.writer = None
 
     def toggle_record(self, window):
         if self.image_size is None:  # Must learn image size first
@@ -55,6 +65,9 @@ class RecordPlugin(Plugin):
             self.stop_recording()
         return {}
 
+    def get_state(self):
+        return {}
+
     def load(self, plugin_state):
         self.record_path = None
         self.record.set(False)  # Always start with record False
@@ -62,9 +75,9 @@ class RecordPlugin(Plugin):
     def process(self, frame):
         self.image_size = frame.shape[:2]
         if self.record.get():
-            frame_bgr = cv2.cvtColor(frame, cv2.COLOR_RGB2BGR)
-            frame_bgr = np.flip(frame_bgr, 1)
-            self.writer.write(frame_bgr)
+            # The capture time of the frame is not known here, so no latency is recorded for it
+            self.frame_count += 1
+            self.writer.put(TimedFrame(frame.copy(), self.frame_count, None))
 
             # Display record icon
             corner = frame[:self.icon_size[0], :self.icon_size[1], :]
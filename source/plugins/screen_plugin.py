@@ -5,30 +5,35 @@ import numpy as np
 
 from pathlib import Path
 from datetime import datetime
-from PyQt5 import QtWidgets
 
 from plugin import Plugin, PluginAction
-from utils import ToggleLink
+from utils import ToggleLink, reuse_buffer
 from PIL import Image
-from mss import mss
+
+MANIFEST = {"name": "Screen", "group": "High Level", "z_index": -100,
+            "actions": ["Share Screen"]}
+
 
 class ScreenPlugin(Plugin):
     def __init__(self):
-        super().__init__("Screen", "High Level", z_index=-100)
+        super().__init__(MANIFEST["name"], MANIFEST["group"], MANIFEST["z_index"])
         self.share_screen = ToggleLink()
         self.path = Path('plugin_data/ScreenPlugin')
         os.makedirs(self.path, exist_ok=True)
 
         self.sct = None
         self.monitor_region = None
+        self.screen_rgb = None
 
     def start_screen_sharing(self):
+        from mss import mss
         self.sct = mss()
         self.monitor_region = self.sct.monitors[1]  # Share 1st screen
 
     def stop_screen_sharing(self):
         if self.sct is not None:
             self.sct.close()
+            self.sct = None
 
     def toggle_screen_sharing(self, window):
         self.share_screen.flip()
@@ -43,18 +48,29 @@ class ScreenPlugin(Plugin):
     def save(self):
         if self.share_screen.get():
             self.stop_screen_sharing()
+        return self.get_state()
+
+    def get_state(self):
         return {'share_screen': self.share_screen.get()}
 
     def load(self, plugin_state):
         self.share_screen.set(plugin_state.get('share_screen', False))
-        if self.share_screen.get():
+        if self.share_screen.get() and self.sct is None:
             self.start_screen_sharing()
+        elif not self.share_screen.get():
+            self.stop_screen_sharing()
+
+    def is_identity(self):
+        return not self.share_screen.get() or self.sct is None
 
     def process(self, frame):
-        image_size = frame.shape[:2]
+        return self.process_into(frame, np.empty_like(frame))
+
+    def process_into(self, src, dst, context=None):
+        image_size = src.shape[:2]
         if self.share_screen.get() and self.sct is not None:
-            screen_img = np.array(self.sct.grab(self.monitor_region))[:, :, :3]
-            screen_img = cv2.resize(screen_img, image_size[::-1], interpolation=cv2.INTER_CUBIC)
-            screen_img = cv2.cvtColor(screen_img, cv2.COLOR_BGR2RGB)
-            return screen_img
-        return frame
+            screen_img = np.asarray(self.sct.grab(self.monitor_region))
+            self.screen_rgb = cv2.cvtColor(screen_img, cv2.COLOR_BGRA2RGB,
+                                           dst=reuse_buffer(self.screen_rgb, screen_img.shape[:2] + (3,)))
+            return cv2.resize(self.screen_rgb, image_size[::-1], dst=dst, interpolation=cv2.INTER_CUBIC)
+        return src
@@ -0,0 +1,184 @@
+"""
+Inference backends for MODNet. A backend is called with an RGB uint8 image whose sides are
+multiples of 32 and returns the float32 alpha matte of the same size. run_batch does the same
+for a list of images of one size in a single forward pass.
+
+eager:       the PyTorch module, with BatchNorms folded into the convolutions
+torchscript: a frozen TorchScript trace of it, one per input size
+onnx:        an ONNX export run by ONNX Runtime, which does not need torch once exported
+
+At int8 precision the ONNX export quantized by quantization.py is run instead.
+"""
+
+import os
+import time
+
+import numpy as np
+
+from utils import reuse_buffer
+
+CHECKPOINT = 'plugins/segmentation_plugin/modnet_webcam_portrait_matting.ckpt'
+CACHE_DIR = 'plugin_data/SegmentationPlugin'
+BACKENDS = ["eager", "torchscript", "onnx"]
+PRECISIONS = ["fp32", "int8"]
+# Of the ONNX export. Per channel INT8 weights in QDQ format need 13, which torch exports from 1.8 on.
+ONNX_OPSET = 13
+
+
+def onnxruntime_available():
+    try:
+        import onnxruntime
+    except ImportError:
+        return False
+    return True
+
+
+def resolve_backend(name, device):
+    # "auto" picks ONNX Runtime on the CPU if it is installed, TorchScript otherwise
+    if name == "auto":
+        return "onnx" if device == "cpu" and onnxruntime_available() else "torchscript"
+    return name
+
+
+def preprocess(images, batch=None):
+    # ToTensor + Normalize(0.5, 0.5) of torchvision: (len(images), 3, height, width) float32 in [-1, 1]
+    batch = reuse_buffer(batch, (len(images), 3) + images[0].shape[:2], np.float32)
+    for image, item in zip(images, batch):
+        np.multiply(image.transpose(2, 0, 1), 1 / 127.5, out=item)
+    batch -= 1
+    return batch
+
+
+def inference_mode(torch):
+    # inference_mode came with torch 1.9 and also skips the version counting of no_grad
+    return torch.inference_mode() if hasattr(torch, "inference_mode") else torch.no_grad()
+
+
+class EagerBackend:
+    name = "eager"
+
+    def __init__(self, model, device="cpu"):
+        import torch
+        self.torch = torch
+        self.device = torch.device(device)
+        self.model = model.to(self.device)  # Once, not on every frame
+        self.inputs = None
+
+    def module(self, shape):
+        return self.model
+
+    def __call__(self, image):
+        return self.run_batch([image])[0]
+
+    def run_batch(self, images):
+        torch = self.torch
+        self.inputs = preprocess(images, self.inputs)
+        module = self.module(self.inputs.shape)
+        with inference_mode(torch):
+            output = module(torch.from_numpy(self.inputs).to(self.device))
+            return output[:, 0].cpu().numpy()
+
+
+class TorchScriptBackend(EagerBackend):
+    name = "torchscript"
+
+    def __init__(self, model, device="cpu"):
+        super().__init__(model, device)
+        self.traced = {}  # Input shape: frozen graph
+
+    def module(self, shape):
+        if shape not in self.traced:
+            from .modnet_inference import trace
+            self.traced[shape] = trace(self.model, shape, self.device)
+        return self.traced[shape]
+
+
+class OnnxBackend:
+    def __init__(self, path, device="cpu", name="onnx"):
+        import onnxruntime
+        self.name = name
+        options = onnxruntime.SessionOptions()
+        options.graph_optimization_level = onnxruntime.GraphOptimizationLevel.ORT_ENABLE_ALL
+        providers = ["CPUExecutionProvider"]
+        if device == "cuda" and "CUDAExecutionProvider" in onnxruntime.get_available_providers():
+            providers.insert(0, "CUDAExecutionProvider")
+        self.session = onnxruntime.InferenceSession(path, options, providers=providers)
+        self.input_name = self.session.get_inputs()[0].name
+        # Exports of older versions have a fixed batch size of 1
+        self.batched = not isinstance(self.session.get_inputs()[0].shape[0], int)
+        self.inputs = None
+
+    def __call__(self, image):
+        return self.run_batch([image])[0]
+
+    def run_batch(self, images):
+        if not self.batched and len(images) > 1:
+            return np.stack([self.run_batch([image])[0] for image in images])
+        self.inputs = preprocess(images, self.inputs)
+        return self.session.run(None, {self.input_name: self.inputs})[0][:, 0]
+
+
+def onnx_model(checkpoint=CHECKPOINT, cache_dir=CACHE_DIR):
+    # Path of the ONNX export of checkpoint, exported again whenever the checkpoint is newer
+    path = os.path.join(cache_dir, "modnet.onnx")
+    if not os.path.exists(path) or os.path.getmtime(path) < os.path.getmtime(checkpoint):
+        from .modnet_inference import export_onnx, load_matting_model
+        os.makedirs(cache_dir, exist_ok=True)
+        export_onnx(load_matting_model(checkpoint), path)
+    return path
+
+
+def int8_model_path(cache_dir=CACHE_DIR):
+    return os.path.join(cache_dir, "modnet_int8.onnx")
+
+
+def create_backend(name="auto", device="cpu", checkpoint=CHECKPOINT, cache_dir=CACHE_DIR, fold=True,
+                   precision="fp32"):
+    if precision == "int8":
+        # Quantized for ONNX Runtime on the CPU, whatever backend was asked for
+        path = int8_model_path(cache_dir)
+        if not os.path.exists(path):
+            raise FileNotFoundError(f"No INT8 model at {path}, create it with "
+                                    f"python -m plugins.segmentation_plugin.quantization")
+        return OnnxBackend(path, "cpu", "onnx-int8")
+    name = resolve_backend(name, device)
+    if name == "onnx":
+        return OnnxBackend(onnx_model(checkpoint, cache_dir), device)
+    if name not in BACKENDS:
+        raise ValueError(f"Unknown segmentation backend {name}, expected one of {BACKENDS}")
+    from .modnet_inference import load_matting_model
+    model = load_matting_model(checkpoint, fold)
+    if name == "torchscript":
+        return TorchScriptBackend(model, device)
+    return EagerBackend(model, device)
+
+
+def benchmark(names, images, runs=20, warmup=3, device="cpu", checkpoint=CHECKPOINT, cache_dir=CACHE_DIR):
+    # Times each backend on each image and compares its mattes to the unfolded eager model
+    reference = create_backend("eager", device, checkpoint, cache_dir, fold=False)
+    expected = [reference(image).copy() for image in images]
+    results = []
+    for name in names:
+        start = time.perf_counter()
+        try:
+            backend = create_backend(name, device, checkpoint, cache_dir)
+        except (ImportError, ValueError, OSError) as e:
+            results.append({"backend": name, "error": str(e)})
+            continue
+        setup = time.perf_counter() - start
+        for image, matte in zip(images, expected):
+            for _ in range(warmup):
+                backend(image)
+            latencies = []
+            for _ in range(runs):
+                start = time.perf_counter()
+                output = backend(image)
+                latencies.append((time.perf_counter() - start) * 1000)
+            p50, p95 = np.percentile(latencies, (50, 95))
+            results.append({"backend": backend.name, "device": device,
+                            "width": image.shape[1], "height": image.shape[0],
+                            "setup_s": setup,
+                            "latency_ms": {"mean": float(np.mean(latencies)), "p50": float(p50),
+                                           "p95": float(p95), "max": float(np.max(latencies))},
+                            "max_abs_diff": float(np.max(np.abs(output - matte)))})
+    return results
@@ -0,0 +1,42 @@
+import cv2
+import numpy as np
+
+from utils import reuse_buffer
+
+
+class BackgroundBlur:
+    """The frame with its background blurred, computed at a fraction of the resolution.
+
+    The frame is downsampled by downscale, blurred with a separable Gaussian of sigma small
+    pixels and upsampled again, so the cost hardly depends on the blur radius. The blur is
+    weighted by the background part of the matte, so the person does not bleed into the
+    blurred background around them.
+    """
+
+    def __init__(self, downscale=8, sigma=3):
+        self.downscale = downscale
+        self.sigma = sigma
+        self.small = None
+        self.weight = None
+        self.frame = None
+
+    def __call__(self, frame, alpha):
+        # frame: RGB, alpha: uint8 matte of the person. Returns a frame of the same shape.
+        height, width = frame.shape[:2]
+        size = (max(1, width // self.downscale), max(1, height // self.downscale))
+        small = self.small = cv2.resize(frame, size, dst=reuse_buffer(self.small, (size[1], size[0], 3)),
+                                        interpolation=cv2.INTER_AREA)
+        weight = self.weight = cv2.resize(alpha, size, dst=reuse_buffer(self.weight, size[::-1]),
+                                          interpolation=cv2.INTER_AREA)
+        # Background weight in [0, 1] and the weighted colors, blurred with the same kernel
+        weight = np.subtract(255, weight, dtype=np.float32)
+        weight *= 1 / 255
+        colors = small * weight[..., None]
+        cv2.GaussianBlur(colors, (0, 0), self.sigma, dst=colors)
+        cv2.GaussianBlur(weight, (0, 0), self.sigma, dst=weight)
+        np.maximum(weight, 1e-3, out=weight)
+        colors /= weight[..., None]
+        cv2.convertScaleAbs(colors, dst=small)
+        self.frame = cv2.resize(small, (width, height), dst=reuse_buffer(self.frame, frame.shape),
+                                interpolation=cv2.INTER_LINEAR)
+        return self.frame
@@ -0,0 +1,71 @@
+import threading
+
+import cv2
+import numpy as np
+
+
+class MaskWorker:
+    """Computes masks on a background thread, always from the newest submitted image.
+
+    An image submitted while the worker is busy replaces the one still waiting, so the worker
+    never falls behind the stream. latest returns the most recent mask together with the
+    grayscale image it was computed from, for motion compensation, and the frame region it covers.
+    """
+
+    def __init__(self, infer):
+        self.infer = infer  # RGB uint8 image -> float32 mask of the same size
+        self.condition = threading.Condition()
+        self.pending = None
+        self.result = None
+        self.busy = False
+        self.thread = None
+
+    def submit(self, image, gray, roi):
+        with self.condition:
+            self.pending = (image.copy(), gray.copy(), roi)
+            self.condition.notify()
+        if self.thread is None:
+            self.thread = threading.Thread(target=self.run, name="cow-segmentation", daemon=True)
+            self.thread.start()
+
+    def idle(self):
+        with self.condition:
+            return not self.busy and self.pending is None
+
+    def latest(self, timeout=None):
+        # (mask, gray, roi) of the newest result. Without one yet, waits up to timeout while an image is in work.
+        with self.condition:
+            self.condition.wait_for(lambda: self.result is not None or not (self.busy or self.pending), timeout)
+            return self.result
+
+    def run(self):
+        while True:
+            with self.condition:
+                self.condition.wait_for(lambda: self.pending is not None)
+                image, gray, roi = self.pending
+                self.pending = None
+                self.busy = True
+            try:
+                mask = self.infer(image)
+            except Exception as e:
+                print(e)
+                mask = None
+            with self.condition:
+                if mask is not None:
+                    self.result = (mask, gray, roi)
+                self.busy = False
+                self.condition.notify_all()
+
+
+def motion(gray, reference):
+    # Mean absolute difference of two grayscale images, from 0 to 255
+    return cv2.norm(gray, reference, cv2.NORM_L1) / gray.size
+
+
+def compensate(mask, reference, gray, min_response=0.1):
+    # Shifts mask by the global translation from reference to gray, found by phase correlation
+    (dx, dy), response = cv2.phaseCorrelate(reference.astype(np.float32), gray.astype(np.float32))
+    if response < min_response or (abs(dx) < 0.5 and abs(dy) < 0.5):
+        return mask
+    shift = np.float32([[1, 0, dx], [0, 1, dy]])
+    return cv2.warpAffine(mask, shift, mask.shape[::-1], borderMode=cv2.BORDER_REPLICATE)
@@ -0,0 +1,93 @@
+"""
+Inference-only preparation of MODNet: BatchNorm folding and export to TorchScript and ONNX.
+"""
+
+import torch
+import torch.nn as nn
+
+from .backends import ONNX_OPSET
+from .modnet import IBNorm, MODNet
+
+
+class MattingModel(nn.Module):
+    """MODNet reduced to its inference path: normalized RGB batch in, alpha matte out."""
+
+    def __init__(self, network):
+        super().__init__()
+        self.network = network
+
+    def forward(self, img):
+        return self.network(img, True)[2]
+
+
+def fold_batch_norm(conv, bn, channels=None):
+    # Rescales the weights and shifts the bias of conv so that its first channels outputs
+    # already are normalized by bn, using the running statistics of bn
+    channels = conv.out_channels if channels is None else channels
+    scale = bn.weight / torch.sqrt(bn.running_var + bn.eps)
+    weight = conv.weight.detach().clone()
+    bias = torch.zeros(conv.out_channels) if conv.bias is None else conv.bias.detach().clone()
+    weight[:channels] *= scale.view(-1, 1, 1, 1)
+    bias[:channels] = (bias[:channels] - bn.running_mean) * scale + bn.bias
+    conv.weight = nn.Parameter(weight)
+    conv.bias = nn.Parameter(bias)
+
+
+def fold_batch_norms(network):
+    # Folds every BatchNorm that directly follows a convolution into it: the conv_bn blocks of
+    # MobileNetV2 and the BatchNorm half of IBNorm. Returns the number of folded layers.
+    folded = 0
+    with torch.no_grad():
+        for module in list(network.modules()):
+            if not isinstance(module, nn.Sequential):
+                continue
+            for i in range(len(module) - 1):
+                conv, norm = module[i], module[i + 1]
+                if not isinstance(conv, nn.Conv2d):
+                    continue
+                if isinstance(norm, nn.BatchNorm2d):
+                    fold_batch_norm(conv, norm)
+                    module[i + 1] = nn.Identity()
+                elif isinstance(norm, IBNorm) and isinstance(norm.bnorm, nn.BatchNorm2d):
+                    # The instance normalized half depends on the image and stays
+                    fold_batch_norm(conv, norm.bnorm, norm.bnorm_channels)
+                    norm.bnorm = nn.Identity()
+                else:
+                    continue
+                folded += 1
+    return folded
+
+
+def load_matting_model(checkpoint, fold=True):
+    network = MODNet(backbone_pretrained=False)
+    network.load_state_dict(torch.load(checkpoint, map_location=torch.device("cpu")))
+    network.eval()
+    if fold:
+        fold_batch_norms(network)
+    return MattingModel(network).eval()
+
+
+def trace(model, shape, device):
+    # Frozen TorchScript graph for inputs of shape (1, 3, height, width)
+    example = torch.zeros(shape, device=device)
+    with torch.no_grad():
+        traced = torch.jit.trace(model, example)
+    if hasattr(torch.jit, "freeze"):  # Added in torch 1.7
+        traced = torch.jit.freeze(traced)
+    return traced
+
+
+def export_opset(opset=ONNX_OPSET):
+    # torch 1.6 and 1.7 export up to opset 12, MODNet is exported from them at 11 as before
+    major, minor = (int(n) for n in torch.__version__.split(".")[:2])
+    return opset if (major, minor) >= (1, 8) else min(opset, 11)
+
+
+def export_onnx(model, path, size=(352, 256), opset=None):
+    opset = export_opset() if opset is None else opset
+    example = torch.zeros((1, 3, size[1], size[0]))
+    with torch.no_grad():
+        torch.onnx.export(model, example, path, opset_version=opset, do_constant_folding=True,
+                          input_names=["image"], output_names=["matte"],
+                          dynamic_axes={"image": {0: "batch", 2: "height", 3: "width"},
+                                        "matte": {0: "batch", 2: "height", 3: "width"}})
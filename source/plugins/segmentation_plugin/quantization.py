@@ -0,0 +1,138 @@
+"""
+Static INT8 post-training quantization of the MODNet ONNX export with ONNX Runtime.
+
+Activation ranges are calibrated on frames of a video or a directory of images, ideally
+recorded with the webcams and rooms the model will see. Run from the source directory:
+
+    python -m plugins.segmentation_plugin.quantization --calibration calibration.mp4
+
+The INT8 model is written next to the FP32 export, where the segmentation plugin picks it up
+when its precision is set to int8, and a comparison of both models is printed as JSON.
+"""
+
+import argparse
+import glob
+import json
+import os
+import sys
+import time
+
+import cv2
+import numpy as np
+import onnx
+from onnxruntime.quantization import CalibrationDataReader, CalibrationMethod, QuantFormat, QuantType, \
+    quantize_static
+
+from utils import cover_fit
+from .backends import CACHE_DIR, CHECKPOINT, ONNX_OPSET, OnnxBackend, int8_model_path, onnx_model, preprocess
+
+
+class FrameReader(CalibrationDataReader):
+    def __init__(self, images, input_name="image"):
+        self.batches = iter([{input_name: preprocess([image]).copy()} for image in images])
+
+    def get_next(self):
+        return next(self.batches, None)
+
+
+def read_frames(path, size, count):
+    # Up to count RGB frames, spread over the video or image directory at path and cover-fitted to size
+    if os.path.isdir(path):
+        files = sorted(f for f in glob.glob(os.path.join(path, "*")) if os.path.isfile(f))
+        files = files[::max(1, len(files) // count)][:count]
+        images = (cv2.imread(f) for f in files)
+    else:
+        video = cv2.VideoCapture(path)
+        step = max(1, int(video.get(cv2.CAP_PROP_FRAME_COUNT)) // count)
+
+        def frames():
+            while True:
+                ok, frame = video.read()
+                if not ok:
+                    return
+                yield frame
+                for _ in range(step - 1):
+                    video.grab()
+        images = frames()
+    frames = []
+    for image in images:
+        if image is not None:
+            frames.append(cv2.cvtColor(cover_fit(image, *size), cv2.COLOR_BGR2RGB))
+        if len(frames) == count:
+            break
+    if not frames:
+        raise ValueError(f"Could not read any frame from {path}")
+    return frames
+
+
+def onnx_opset(path):
+    return next(entry.version for entry in onnx.load(path).opset_import if entry.domain in ("", "ai.onnx"))
+
+
+def quantize(fp32_path, int8_path, images):
+    # QDQ format with INT8 weights and UINT8 activations, which ONNX Runtime fuses into integer
+    # convolutions on the CPU. Weights are quantized per channel if the export has ONNX_OPSET, per
+    # tensor if it was exported by a torch older than 1.8.
+    quantize_static(fp32_path, int8_path, FrameReader(images),
+                    quant_format=QuantFormat.QDQ, per_channel=onnx_opset(fp32_path) >= ONNX_OPSET,
+                    activation_type=QuantType.QUInt8, weight_type=QuantType.QInt8,
+                    calibrate_method=CalibrationMethod.MinMax)
+
+
+def compare(fp32, int8, images, runs=3):
+    # Matte agreement of the INT8 model with the FP32 one and the latencies of both
+    errors, ious, latencies = [], [], {"fp32": [], "int8": []}
+    for image in images:
+        mattes = {}
+        for name, backend in (("fp32", fp32), ("int8", int8)):
+            for _ in range(runs):
+                start = time.perf_counter()
+                mattes[name] = backend(image)
+                latencies[name].append((time.perf_counter() - start) * 1000)
+        error = np.abs(mattes["int8"] - mattes["fp32"])
+        errors.append((float(error.mean()), float(np.percentile(error, 99))))
+        foreground = mattes["fp32"] > 0.5, mattes["int8"] > 0.5
+        union = np.count_nonzero(foreground[0] | foreground[1])
+        ious.append(np.count_nonzero(foreground[0] & foreground[1]) / union if union else 1.0)
+    fp32_ms, int8_ms = float(np.median(latencies["fp32"])), float(np.median(latencies["int8"]))
+    return {"frames": len(images),
+            "mean_abs_error": float(np.mean([e[0] for e in errors])),
+            "p99_abs_error": float(np.mean([e[1] for e in errors])),
+            "foreground_iou": float(np.mean(ious)), "min_foreground_iou": float(np.min(ious)),
+            "latency_ms": {"fp32": fp32_ms, "int8": int8_ms},
+            "speedup": fp32_ms / int8_ms}
+
+
+def parse_args(argv):
+    parser = argparse.ArgumentParser(description="Quantize MODNet to INT8 for the CPU.")
+    parser.add_argument("--calibration", required=True, help="video file or image directory to calibrate on")
+    parser.add_argument("--evaluation", default=None,
+                        help="video file or image directory to compare on, frames in between the "
+                             "calibration frames by default")
+    parser.add_argument("--frames", type=int, default=64, help="number of calibration frames")
+    parser.add_argument("--size", default="352x256", help="input size WxH, multiples of 32")
+    parser.add_argument("--checkpoint", default=CHECKPOINT)
+    parser.add_argument("--cache-dir", default=CACHE_DIR)
+    return parser.parse_args(argv)
+
+
+def main(argv=None):
+    args = parse_args(sys.argv[1:] if argv is None else argv)
+    size = tuple(int(n) for n in args.size.split("x"))
+    if args.evaluation is None:
+        frames = read_frames(args.calibration, size, 2 * args.frames)
+        calibration, evaluation = frames[::2], frames[1::2]
+    else:
+        calibration = read_frames(args.calibration, size, args.frames)
+        evaluation = read_frames(args.evaluation, size, args.frames)
+    fp32_path = onnx_model(args.checkpoint, args.cache_dir)
+    int8_path = int8_model_path(args.cache_dir)
+    quantize(fp32_path, int8_path, calibration)
+    report = {"model": int8_path, "calibration_frames": len(calibration),
+              "comparison": compare(OnnxBackend(fp32_path), OnnxBackend(int8_path), evaluation)}
+    print(json.dumps(report, indent=2))
+    return report
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,64 @@
+import cv2
+import numpy as np
+
+from utils import reuse_buffer
+from .roi import FULL_FRAME, roi_pixels
+
+
+def guided_coefficients(guide, mask, radius, eps):
+    # Window averaged coefficients a, b of the guided filter of mask by guide (He et al.), both
+    # float32 with guide in [0, 1], so that a * guide + b is the filtered mask
+    size = (2 * radius + 1, 2 * radius + 1)
+    mean_i = cv2.boxFilter(guide, -1, size)
+    mean_p = cv2.boxFilter(mask, -1, size)
+    cov_ip = cv2.boxFilter(guide * mask, -1, size) - mean_i * mean_p
+    var_i = cv2.boxFilter(guide * guide, -1, size) - mean_i * mean_i
+    a = cov_ip / (var_i + eps)
+    b = mean_p - a * mean_i
+    return cv2.boxFilter(a, -1, size), cv2.boxFilter(b, -1, size)
+
+
+class GuidedUpsampler:
+    """Upsamples a low resolution matte with the fast guided filter, guided by the full resolution frame.
+
+    The filter coefficients are computed at the resolution of the matte and only interpolated and
+    applied at full resolution, so the edges follow hair and shoulders in the frame at the cost of
+    a few full resolution passes. radius is in matte pixels, eps is relative to a [0, 1] guide.
+    """
+
+    def __init__(self, radius=2, eps=1e-3):
+        self.radius = radius
+        self.eps = eps
+        self.a = None
+        self.b = None
+
+    def __call__(self, mask, roi, gray, alpha):
+        # Writes the matte of region roi into alpha (uint8, 255 for the person, zero outside roi)
+        x0, y0, x1, y1 = roi_pixels(roi, alpha.shape)
+        if roi != FULL_FRAME:
+            alpha.fill(0)
+        guide = gray[y0:y1, x0:x1]
+        low_guide = cv2.resize(guide, mask.shape[::-1], interpolation=cv2.INTER_LINEAR).astype(np.float32)
+        low_guide *= 1 / 255
+        a, b = guided_coefficients(low_guide, mask.astype(np.float32, copy=False), self.radius, self.eps)
+        # On the 0-255 guide and scaled to 0-255, a * guide + b becomes a * gray + 255 * b
+        b *= 255
+        size = (x1 - x0, y1 - y0)
+        a = self.a = cv2.resize(a, size, dst=reuse_buffer(self.a, size[::-1], np.float32),
+                                interpolation=cv2.INTER_LINEAR)
+        b = self.b = cv2.resize(b, size, dst=reuse_buffer(self.b, size[::-1], np.float32),
+                                interpolation=cv2.INTER_LINEAR)
+        cv2.multiply(a, guide, dst=a, dtype=cv2.CV_32F)
+        cv2.add(a, b, dst=alpha[y0:y1, x0:x1], dtype=cv2.CV_8U)  # Rounds and saturates to 0-255
+        return alpha
+
+
+def composite(src, background, alpha, alpha3, inverse3, dst):
+    # dst = (src * alpha + background * (255 - alpha)) / 255 in uint8 fixed point, within one unit.
+    # alpha3 and inverse3 are scratch buffers of the shape of src.
+    cv2.merge((alpha, alpha, alpha), dst=alpha3)
+    cv2.bitwise_not(alpha3, dst=inverse3)
+    cv2.multiply(src, alpha3, dst=dst, scale=1 / 255)
+    cv2.multiply(background, inverse3, dst=inverse3, scale=1 / 255)
+    cv2.add(dst, inverse3, dst=dst)
+    return dst
@@ -0,0 +1,73 @@
+import math
+
+import cv2
+import numpy as np
+
+# Regions are (x0, y0, x1, y1) in fractions of the frame size, so that they survive resolution changes
+FULL_FRAME = (0.0, 0.0, 1.0, 1.0)
+# Aspect ratios of the network input. Few of them keep the number of input sizes, and with it
+# the per-size work of backends like TorchScript, small.
+ASPECTS = (9 / 16, 3 / 4, 1, 4 / 3, 16 / 9)
+
+
+def snap_aspect(aspect):
+    return min(ASPECTS, key=lambda a: abs(math.log(a / aspect)))
+
+
+def input_size(aspect, budget):
+    # Network input of about budget pixels with the given aspect ratio, both sides multiples of 32
+    width = math.sqrt(budget * aspect)
+    return max(32, int(round(width / 32)) * 32), max(32, int(round(width / aspect / 32)) * 32)
+
+
+def roi_pixels(roi, shape):
+    height, width = shape[:2]
+    return (int(round(roi[0] * width)), int(round(roi[1] * height)),
+            int(round(roi[2] * width)), int(round(roi[3] * height)))
+
+
+def crop_input(frame, roi, budget, context=None):
+    # The region roi of frame, scaled to a network input of at most budget pixels. Small regions
+    # are not scaled up beyond their own size.
+    x0, y0, x1, y1 = roi_pixels(roi, frame.shape)
+    size = input_size(snap_aspect((x1 - x0) / (y1 - y0)), min(budget, (x1 - x0) * (y1 - y0)))
+    if roi == FULL_FRAME and context is not None:
+        return context.resized(size)
+    return cv2.resize(frame[y0:y1, x0:x1], size, interpolation=cv2.INTER_LINEAR)
+
+
+def track(mask, roi, shape, padding=0.2, min_size=0.25, threshold=0.5, min_foreground=0.01):
+    # Region for the next inference: the box around the foreground of mask, the matte of region roi,
+    # padded by a fraction of its size for movement until then, at least min_size of the frame on
+    # each side and grown to the nearest of ASPECTS. FULL_FRAME when there is too little to track.
+    foreground = (mask > threshold).astype(np.uint8)
+    if cv2.countNonZero(foreground) < min_foreground * foreground.size:
+        return FULL_FRAME
+    x, y, w, h = cv2.boundingRect(foreground)
+    height, width = shape[:2]
+    rx0, ry0, rx1, ry1 = roi_pixels(roi, shape)
+    sx, sy = (rx1 - rx0) / mask.shape[1], (ry1 - ry0) / mask.shape[0]
+    x0, y0, x1, y1 = rx0 + x * sx, ry0 + y * sy, rx0 + (x + w) * sx, ry0 + (y + h) * sy
+    pad = padding * max(x1 - x0, y1 - y0)
+    w = max(x1 - x0 + 2 * pad, min_size * width)
+    h = max(y1 - y0 + 2 * pad, min_size * height)
+    aspect = snap_aspect(w / h)
+    if w / h < aspect:
+        w = h * aspect
+    else:
+        h = w / aspect
+    w, h = min(w, width), min(h, height)
+    if w == width and h == height:
+        return FULL_FRAME
+    x0 = min(max((x0 + x1 - w) / 2, 0), width - w)
+    y0 = min(max((y0 + y1 - h) / 2, 0), height - h)
+    return x0 / width, y0 / height, (x0 + w) / width, (y0 + h) / height
+
+
+def paste(mask, roi, dst):
+    # Scales mask onto its region roi of dst, which is zero around it
+    x0, y0, x1, y1 = roi_pixels(roi, dst.shape)
+    if roi != FULL_FRAME:
+        dst.fill(0)
+    cv2.resize(mask, (x1 - x0, y1 - y0), dst=dst[y0:y1, x0:x1], interpolation=cv2.INTER_LINEAR)
+    return dst
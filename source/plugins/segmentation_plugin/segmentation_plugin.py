@@ -1,125 +1,311 @@
-from plugin import Plugin, PluginAction
-from utils import crop_center, ToggleLink
-
-from PyQt5 import QtWidgets
-from PyQt5.QtWidgets import QMessageBox
+from backgrounds import ImageBackground, open_background
+from plugin import Plugin, PluginAction, QualityKnob
+from utils import reuse_buffer, ToggleLink
 
 import cv2
 import os
 import time
 import shutil
-from PIL import Image
+import threading
+from collections import deque
 import numpy as np
 
-import torch
-import torchvision
-from torchvision import transforms
-from .modnet import MODNet
+from .backends import create_backend
+from .blur import BackgroundBlur
+from .mask_worker import MaskWorker, compensate, motion
+from .refine import composite, GuidedUpsampler
+from .roi import crop_input, FULL_FRAME, paste, track
+
+MANIFEST = {"name": "Segmentation", "group": "Misc", "z_index": -1,
+            "actions": ["Active", "Use GPU acceleration", "Use INT8 model", "Select background",
+                        "Blur background"]}
+
+
+def cuda_available():
+    try:
+        import torch
+    except ImportError:  # The ONNX backend runs without torch
+        return False
+    return torch.cuda.is_available()
 
 
 class SegmentationPlugin(Plugin):
     def __init__(self):
-        super().__init__("Segmentation", "Misc", z_index=-1)
-        self.network = MODNet(backbone_pretrained=False)
+        super().__init__(MANIFEST["name"], MANIFEST["group"], MANIFEST["z_index"])
+        self.keeps_geometry = True
+        # The inference backend ("auto", "eager", "torchscript" or "onnx") is created by warm_up,
+        # at the latest on the first mask, and again when the device or precision changes
+        self.backend_name = "auto"
+        self.backend = None
+        self.backend_config = None
+        self.backend_lock = threading.Lock()
         self.display = ToggleLink()
         self.use_cuda = ToggleLink()
-        self.preprocess = transforms.Compose([
-            transforms.ToTensor(),
-            transforms.Normalize(mean=[0.5, 0.5, 0.5], std=[0.5, 0.5, 0.5]),
-        ])
+        self.int8 = ToggleLink()
         self.scale_factor = 2
+        # Set by the quality governor
+        self.min_scale_factor = None
+        self.inference_interval = 1
+        self.frames_since_inference = 0
+        # Inference on a worker thread, while frames are composited with the latest mask
+        self.asynchronous = True
+        self.motion_threshold = 8  # Mean absolute difference of the network inputs that triggers inference
+        self.motion_compensation = True
+        # Inference on a padded crop around the person in the previous mask
+        self.track_person = True
+        # Guided filter upsampling of the matte, bilinear otherwise
+        self.refine_edges = True
+        self.upsampler = GuidedUpsampler()
+        self.worker = MaskWorker(self.get_mask)
+        # (mask, roi) of the next frames, computed by prepare_batch in offline processing
+        self.batched_masks = deque()
+        self.offline = False
+        self.input_gray = None
         self.path = 'plugin_data/SegmentationPlugin'
         os.makedirs(self.path, exist_ok=True)
-        self.network.load_state_dict(torch.load(
-            'plugins/segmentation_plugin/modnet_webcam_portrait_matting.ckpt',
-            map_location=torch.device("cpu")))
-        self.network.eval()
         self.background_path = None
-        self.background = np.random.randint(0, 255, (1080, 1920, 3), np.uint8)
+        # Scaled and oriented to the frames by the background source, videos decoded on their own thread
+        self.background = self.noise_background()
+        self.background_source_path = None
+        # Blurs the background of the frame itself instead of replacing it
+        self.blur = ToggleLink()
+        self.background_blur = BackgroundBlur()
         self.device_mapping = {True: "cuda", False: "cpu"}
+        self.mask = None
+        self.alpha = None
+        self.alpha3 = None
+        self.inverse_alpha3 = None
+        self.low_res_mask = None
+
+    def get_backend_config(self):
+        return self.device_mapping[self.use_cuda.get()], "int8" if self.int8.get() else "fp32"
+
+    def warm_up(self):
+        config = self.get_backend_config()
+        with self.backend_lock:
+            if self.backend is not None and self.backend_config == config:
+                return
+            device, precision = config
+            try:
+                self.backend = create_backend(self.backend_name, device, cache_dir=self.path, precision=precision)
+            except (ImportError, OSError) as e:
+                if precision == "fp32":
+                    raise
+                print(f"Could not load the {precision} model, using fp32: {e}")
+                self.backend = create_backend(self.backend_name, device, cache_dir=self.path)
+            self.backend_config = config
+
+    def set_backend(self, name):
+        # "auto", "eager", "torchscript" or "onnx", created on the next warm_up
+        with self.backend_lock:
+            if name != self.backend_name:
+                self.backend_name = name
+                self.backend = None
 
     def toggle_display(self, window):
         self.display.flip()
 
     def change_device(self, window):
-        if not self.use_cuda and not torch.cuda.is_available():
-            mbox = QMessageBox(window)
-            mbox.setText("No CUDA compatible device available")
-            mbox.setWindowTitle(self.plugin_name)
-            mbox.setIcon(QMessageBox.Warning)
-            mbox.show()
+        if not self.use_cuda and not cuda_available():
+            from dialogs.messages import show_warning
+            show_warning(window, self.plugin_name, "No CUDA compatible device available")
         else:
             self.use_cuda.flip()
 
+    def toggle_int8(self, window):
+        self.int8.flip()
+
+    def toggle_blur(self, window):
+        self.blur.flip()
+        if self.blur.get():
+            self.display.set(True)
+
     def get_actions(self):
         return [PluginAction("Active", self.toggle_display, self.display),
                 PluginAction("Use GPU acceleration", self.change_device, self.use_cuda),
-                PluginAction("Select background", self.select_background, False)]
+                PluginAction("Use INT8 model", self.toggle_int8, self.int8),
+                PluginAction("Select background", self.select_background, False),
+                PluginAction("Blur background", self.toggle_blur, self.blur)]
 
     def save(self):
         return {"background_path": self.background_path,
                 "display": self.display.get(),
-                "use_cuda": self.use_cuda.get()}
+                "use_cuda": self.use_cuda.get(),
+                "backend": self.backend_name,
+                "precision": "int8" if self.int8.get() else "fp32",
+                "asynchronous": self.asynchronous,
+                "motion_threshold": self.motion_threshold,
+                "motion_compensation": self.motion_compensation,
+                "track_person": self.track_person,
+                "refine_edges": self.refine_edges,
+                "blur": self.blur.get(),
+                "blur_sigma": self.background_blur.sigma}
 
     def load(self, plugin_state):
         self.background_path = plugin_state.get("background_path", None)
         self.display.set(plugin_state.get("display", False))
-        self.use_cuda.set(plugin_state.get("use_cuda", False) and torch.cuda.is_available())
+        self.use_cuda.set(plugin_state.get("use_cuda", False) and cuda_available())
+        self.int8.set(plugin_state.get("precision", "fp32") == "int8")
+        self.set_backend(plugin_state.get("backend", "auto"))
+        self.asynchronous = plugin_state.get("asynchronous", True)
+        self.motion_threshold = plugin_state.get("motion_threshold", 8)
+        self.motion_compensation = plugin_state.get("motion_compensation", True)
+        self.track_person = plugin_state.get("track_person", True)
+        self.refine_edges = plugin_state.get("refine_edges", True)
+        self.blur.set(plugin_state.get("blur", False))
+        self.background_blur.sigma = plugin_state.get("blur_sigma", 3)
 
         self.load_background(self.background_path)
 
-    def load_background(self, file_path):
-        if file_path is not None:
-            img = cv2.imread(file_path)
-            if img is not None:
-                self.background = img
-                return True
-            else:
-                video = cv2.VideoCapture(file_path)
-                if video.isOpened():
-                    self.background = video
-                    return True
-        self.background = np.random.randint(0, 255, (1920, 1080, 3), np.uint8)
-        return False
+    @staticmethod
+    def noise_background():
+        return ImageBackground(np.random.randint(0, 255, (1080, 1920, 3), np.uint8))
 
-    def get_background_frame(self):
-        if isinstance(self.background, cv2.VideoCapture):
-            ret, frame = self.background.read()
-            if ret:
-                return frame
-            else:
-                self.load_background(self.background_path)
-                return self.get_background_frame()
-        else:
-            return self.background
+    def load_background(self, file_path):
+        if file_path is not None and file_path == self.background_source_path:
+            return True  # Already playing
+        background = open_background(file_path)
+        self.background.close()
+        self.background = background or self.noise_background()
+        self.background_source_path = file_path if background is not None else None
+        return background is not None
 
     def select_background(self, window):
-        file_name, _ = QtWidgets.QFileDialog.getOpenFileName(window, "Select Image or Video", "")
+        from dialogs.messages import get_open_file_name
+        file_name = get_open_file_name(window, "Select Image or Video")
         if self.load_background(file_name):
             self.background_path = os.path.join(self.path, str(time.time()) + os.path.splitext(file_name)[1])
             shutil.copy(file_name, self.background_path)
+        self.blur.set(False)
         self.display.set(True)
 
+    def get_backend(self):
+        backend = self.backend
+        if backend is None or self.backend_config != self.get_backend_config():
+            self.warm_up()
+            backend = self.backend
+        return backend
+
     def get_mask(self, input_image):
-        input_tensor = self.preprocess(input_image)
-        device = self.device_mapping[self.use_cuda.get()]
-        self.network.to(device)
-        input_batch = input_tensor.unsqueeze(0).to(device)
-        with torch.no_grad():
-            output = self.network(input_batch, True)[-1]
-        mask = output[0, 0].cpu().numpy()
-        return mask
+        # input_image: RGB with both sides multiples of 32
+        return self.get_backend()(input_image)
+
+    def prepare_batch(self, frames):
+        # One forward pass for all frames. They share the region tracked from the last mask, which
+        # the person is unlikely to leave within a batch, so the crops have the same size.
+        self.offline = True  # Also makes video backgrounds advance by exactly one frame per frame
+        self.batched_masks.clear()  # Left over if the previous batch was not processed to the end
+        roi = self.get_roi(self.low_res_mask, frames[0].shape)
+        budget = int(np.prod(self.input_size()))
+        masks = self.get_backend().run_batch([crop_input(frame, roi, budget) for frame in frames])
+        self.batched_masks.extend((mask, roi) for mask in masks)
+
+    def is_identity(self):
+        return not self.display.get()
+
+    def get_quality_knobs(self):
+        return [QualityKnob("Segmentation interval", 10, [1, 2, 3], self.set_inference_interval),
+                QualityKnob("Segmentation scale", 20, [None, 3, 4], self.set_min_scale_factor)]
+
+    def set_inference_interval(self, interval):
+        self.inference_interval = interval
+
+    def set_min_scale_factor(self, scale_factor):
+        self.min_scale_factor = scale_factor
+
+    def input_size(self):
+        # MODNet needs both sides to be multiples of 32
+        scale_factor = max(self.scale_factor, self.min_scale_factor or 0)
+        width, height = 672 / scale_factor + 16, 512 / scale_factor
+        return max(32, int(round(width / 32)) * 32), max(32, int(round(height / 32)) * 32)
+
+    def get_roi(self, result, shape):
+        # Region of the frame for the next inference, tracked from the last (mask, ..., roi)
+        if not self.track_person or result is None:
+            return FULL_FRAME
+        return track(result[0], result[-1], shape)
+
+    def get_low_res_mask(self, frame, context=None):
+        # (mask, roi): the matte of the region roi of the frame, with as many pixels as input_size
+        if self.batched_masks:
+            self.low_res_mask = self.batched_masks.popleft()
+            return self.low_res_mask
+        budget = int(np.prod(self.input_size()))
+        self.frames_since_inference += 1
+        if not self.asynchronous:
+            # Reuses the previous mask for inference_interval - 1 frames
+            if self.low_res_mask is None or self.frames_since_inference >= self.inference_interval:
+                roi = self.get_roi(self.low_res_mask, frame.shape)
+                self.low_res_mask = self.get_mask(crop_input(frame, roi, budget, context)), roi
+                self.frames_since_inference = 0
+            return self.low_res_mask
+        return self.get_async_mask(frame, budget, context)
+
+    def get_async_mask(self, frame, budget, context=None):
+        # The newest mask of the worker, shifted to follow the camera. A new one is requested
+        # every inference_interval frames or as soon as the image moved by motion_threshold.
+        result = self.worker.latest(timeout=0)
+        gray = None
+        if result is not None:
+            mask, reference, roi = result
+            # The current frame cropped and scaled like the image of the latest mask
+            current = crop_input(frame, roi, budget, context)
+            if current.shape[:2] == reference.shape:
+                gray = self.input_gray = cv2.cvtColor(current, cv2.COLOR_RGB2GRAY,
+                                                      dst=reuse_buffer(self.input_gray, reference.shape))
+        due = gray is None or self.frames_since_inference >= self.inference_interval or \
+            motion(gray, reference) > self.motion_threshold
+        if due and self.worker.idle():
+            next_roi = self.get_roi(result, frame.shape)
+            if gray is None or next_roi != roi:
+                current = crop_input(frame, next_roi, budget, context)
+            self.worker.submit(current, cv2.cvtColor(current, cv2.COLOR_RGB2GRAY), next_roi)
+            self.frames_since_inference = 0
+        if result is None:
+            # The first mask, e.g. while the model loads, is only waited for offline. The stream shows
+            # the unchanged frames in the meantime.
+            result = self.worker.latest(timeout=10) if self.offline else None
+            return None if result is None else (result[0], result[2])
+        if self.motion_compensation and gray is not None:
+            mask = compensate(mask, reference, gray)
+        return mask, roi
+
+    def get_oriented_background(self, shape):
+        # Mirrored and converted to RGB to match the frames in the chain
+        return self.background.get(shape, wait=self.offline)
 
     def process(self, frame):
-        if self.display.get():
-            input_image = cv2.resize(frame, (672 // self.scale_factor + 16, 512 // self.scale_factor),
-                                     interpolation=cv2.INTER_LINEAR)
-            input_image = Image.fromarray(input_image)
-            mask = self.get_mask(input_image)
-            mask = cv2.resize(mask, frame.shape[:2][::-1], interpolation=cv2.INTER_LINEAR)[..., None]
-            background = self.get_background_frame()[:, ::-1, ::-1]
-            if background.shape != frame.shape:
-                background = crop_center(background, *frame.shape[:2])
-            frame = (frame * mask + background * (1 - mask)).astype(np.uint8)
-        return frame
+        return self.process_into(frame, np.empty_like(frame))
+
+    def process_into(self, src, dst, context=None):
+        if not self.display.get():
+            return src
+        self.prepare_kernel(src, context)(src, dst, slice(None))
+        return dst
+
+    def prepare_kernel(self, src, context=None):
+        result = self.get_low_res_mask(src, context)
+        if result is None:  # No mask yet, e.g. while the model loads, or none could be computed
+            def kernel(src, dst, rows):
+                np.copyto(dst[rows], src[rows])
+            return kernel
+        alpha = self.alpha = reuse_buffer(self.alpha, src.shape[:2])
+        if self.refine_edges:
+            gray = context.gray() if context is not None else cv2.cvtColor(src, cv2.COLOR_RGB2GRAY)
+            self.upsampler(*result, gray, alpha)
+        else:
+            self.mask = paste(*result, reuse_buffer(self.mask, src.shape[:2], np.float32))
+            cv2.convertScaleAbs(self.mask, dst=alpha, alpha=255)
+        if context is not None:
+            context.alpha = alpha
+        alpha3 = self.alpha3 = reuse_buffer(self.alpha3, src.shape)
+        inverse3 = self.inverse_alpha3 = reuse_buffer(self.inverse_alpha3, src.shape)
+        if self.blur.get():
+            background = self.background_blur(src, alpha)
+        else:
+            background = self.get_oriented_background(src.shape)
+
+        def kernel(src, dst, rows):
+            composite(src[rows], background[rows], alpha[rows], alpha3[rows], inverse3[rows], dst[rows])
+        return kernel
 
@@ -1,15 +1,17 @@
 from plugin import Plugin, PluginAction
 import numpy as np
 
-from PyQt5 import QtWidgets
-from PyQt5.QtWidgets import QDialog
 import cv2
 
+MANIFEST = {"name": "Add Text", "group": "High Level", "z_index": 110,
+            "actions": ["Write Text"]}
+
 
 class TextPlugin(Plugin):
     def __init__(self):
-        super().__init__("Add Text", "High Level", z_index=110)
-        self.dlg: TextInputDialog = None
+        super().__init__(MANIFEST["name"], MANIFEST["group"], MANIFEST["z_index"])
+        self.keeps_geometry = True
+        self.dlg = None
         self.font = cv2.FONT_HERSHEY_SIMPLEX
         self.font_scale = 1
         self.font_color = (255, 255, 255)
@@ -17,12 +19,14 @@ class TextPlugin(Plugin):
         self.line_type = 2
         self.current_text = ""
         self.text_overlay = None
+        self.multiprocess_safe = False  # Text is read from the dialog
 
     def get_actions(self):
         return [PluginAction("Write Text", self.show_dialog, False)]
 
     def show_dialog(self, window):
         if not self.dlg:
+            from dialogs.text_dialog import TextInputDialog
             self.dlg = TextInputDialog(window)
         if self.dlg.isHidden():
             pw = self.dlg.parent().geometry().width()
@@ -43,6 +47,10 @@ class TextPlugin(Plugin):
         frame[y:y+self.text_overlay.shape[0], x:x+self.text_overlay.shape[1]] = self.text_overlay
         return frame
 
+    def is_identity(self):
+        pending = self.dlg is not None and self.current_text != self.dlg.written_text
+        return self.text_overlay is None and not pending
+
     def get_overlay(self, frame_shape, text_pad=15, bg_gray=127):
         if self.dlg is None or self.current_text == self.dlg.written_text:
             return
@@ -57,28 +65,3 @@ class TextPlugin(Plugin):
         self.text_overlay *= bg_gray
         cv2.putText(self.text_overlay, self.current_text, (0, int(text_height*0.75)), self.font,
                     self.font_scale, self.font_color, self.thickness, self.line_type)
-
-
-class TextInputDialog(QDialog):
-    def __init__(self, args, **kwargs):
-        super(TextInputDialog, self).__init__(args, **kwargs)
-        self.written_text = ""
-        self.setup_ui()
-
-    # noinspection PyAttributeOutsideInit
-    def setup_ui(self):
-        self.setWindowTitle("Text")
-
-        self.layout = QtWidgets.QVBoxLayout()
-        self.layout.addWidget(self.create_text_input())
-        self.setLayout(self.layout)
-
-    # noinspection PyAttributeOutsideInit
-    def create_text_input(self):
-        self.text_area = QtWidgets.QLineEdit()
-        self.text_area.textChanged.connect(self.text_changed)
-        return self.text_area
-
-    def text_changed(self):
-        text = self.text_area.text().strip()
-        self.written_text = text
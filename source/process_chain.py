@@ -0,0 +1,170 @@
+import importlib
+import multiprocessing
+import queue
+import threading
+import time
+
+import numpy as np
+
+from plugin import make_chain_process
+
+
+def group_by_z_index(plugins, boundaries):
+    # Splits plugins (sorted by z_index) into consecutive groups at the given z_index boundaries
+    groups = [[] for _ in range(len(boundaries) + 1)]
+    for plugin in plugins:
+        groups[sum(plugin.z_index >= boundary for boundary in boundaries)].append(plugin)
+    return [group for group in groups if group]
+
+
+def plugin_key(plugin):
+    return plugin.__class__.__module__, plugin.__class__.__name__
+
+
+def shared_frames(slots, shape):
+    return np.frombuffer(slots, np.uint8).reshape((-1,) + tuple(shape))
+
+
+def stage_loop(chain, frames, tasks, results, sync=None):
+    # Processes frames in place in their shared slots and hands the slot index to the next stage
+    while True:
+        task = tasks.get()
+        if task is None:
+            results.put(None)
+            return
+        if sync is not None:
+            sync()
+        slot, tag, timings = task
+        start = time.perf_counter()
+        frame = frames[slot]
+        try:
+            out = chain(frame)
+            if out is not frame:
+                np.copyto(frame, out)
+        except Exception as e:
+            print(e)
+        results.put((slot, tag, timings + (time.perf_counter() - start,)))
+
+
+def run_stage(keys, states, slots, shape, tasks, results, controls):
+    # Entry point of a stage process: rebuilds its plugins from their saved states
+    plugins = []
+    for module_name, class_name in keys:
+        plugin = getattr(importlib.import_module(module_name), class_name)()
+        plugin.load(states[(module_name, class_name)])
+        plugins.append(plugin)
+
+    def sync():
+        try:
+            while True:
+                new_states = controls.get_nowait()
+                for plugin in plugins:
+                    plugin.load(new_states[plugin_key(plugin)])
+        except queue.Empty:
+            pass
+
+    stage_loop(make_chain_process(plugins), shared_frames(slots, shape), tasks, results, sync)
+
+
+class ProcessChain:
+    """Runs groups of plugins, split at z_index boundaries, as concurrent pipeline stages.
+
+    Groups whose plugins are all multiprocess safe run in their own process, the others in a
+    thread of this process. Frames stay in shared memory slots for their whole trip through the
+    stages and only slot indices are queued, so consecutive frames are processed by different
+    stages (e.g. segmentation of frame N while frame N-1 gets its overlays) without pickling.
+    """
+
+    def __init__(self, plugins, shape, boundaries=(0, 100), num_slots=4, stats=None, sync_interval=10):
+        context = multiprocessing.get_context("spawn")
+        self.plugins = plugins
+        self.shape = tuple(shape)
+        self.stats = stats
+        self.sync_interval = sync_interval
+        self.slots = context.RawArray("B", num_slots * int(np.prod(self.shape)))
+        self.frames = shared_frames(self.slots, self.shape)
+        self.free_slots = queue.Queue()
+        for slot in range(num_slots):
+            self.free_slots.put(slot)
+        self.submitted = 0
+        self.dropped = 0
+
+        self.groups = group_by_z_index(plugins, boundaries)
+        self.queues = [context.Queue() for _ in range(len(self.groups) + 1)]
+        self.controls = []
+        self.remote_plugins = []
+        self.workers = []
+        for i, group in enumerate(self.groups):
+            if all(plugin.multiprocess_safe for plugin in group):
+                controls = context.Queue()
+                worker = context.Process(target=run_stage, daemon=True,
+                                         args=([plugin_key(p) for p in group], self.get_states(group),
+                                               self.slots, self.shape, self.queues[i], self.queues[i + 1], controls))
+                self.controls.append(controls)
+                self.remote_plugins.extend(group)
+            else:
+                worker = threading.Thread(target=stage_loop, daemon=True,
+                                          args=(make_chain_process(group), self.frames,
+                                                self.queues[i], self.queues[i + 1]))
+            worker.start()
+            self.workers.append(worker)
+        self.states = self.get_states(self.remote_plugins)
+        self.stage_names = ["stage {0}: {1}".format(i, ", ".join(p.plugin_name for p in group))
+                            for i, group in enumerate(self.groups)]
+
+    @staticmethod
+    def get_states(plugins):
+        states = {}
+        for plugin in plugins:
+            plugin.update_state()
+            states[plugin_key(plugin)] = plugin.get_state()
+        return states
+
+    def sync_states(self):
+        # Forwards option changes of the local plugin instances to the stage processes
+        states = self.get_states(self.remote_plugins)
+        if states != self.states:
+            self.states = states
+            for controls in self.controls:
+                controls.put(states)
+
+    def submit(self, frame, tag=None):
+        # tag (e.g. the sequence number and timestamp of the frame) comes back out with the frame.
+        # Returns False if the frame was dropped because all slots are in flight.
+        if frame.shape != self.shape:
+            print(f"Frame of shape {frame.shape} does not fit the {self.shape} slots")
+            return False
+        try:
+            slot = self.free_slots.get_nowait()
+        except queue.Empty:
+            self.dropped += 1
+            return False
+        if self.submitted % self.sync_interval == 0:
+            self.sync_states()
+        np.copyto(self.frames[slot], frame)
+        self.queues[0].put((slot, tag, ()))
+        self.submitted += 1
+        return True
+
+    def collect(self, out, timeout=None):
+        # Copies the next finished frame into out and returns (out, tag), or None on timeout or after close
+        try:
+            task = self.queues[-1].get(timeout=timeout)
+        except queue.Empty:
+            return None
+        if task is None:
+            return None
+        slot, tag, timings = task
+        np.copyto(out, self.frames[slot])
+        self.free_slots.put(slot)
+        if self.stats is not None:
+            for name, elapsed in zip(self.stage_names, timings):
+                self.stats.record("process stages", name, elapsed)
+        return out, tag
+
+    def close(self, timeout=5):
+        self.queues[0].put(None)
+        for worker in self.workers:
+            worker.join(timeout)
+            if isinstance(worker, multiprocessing.process.BaseProcess) and worker.is_alive():
+                worker.terminate()
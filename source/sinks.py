@@ -0,0 +1,474 @@
+import http.server
+import mmap
+import os
+import socketserver
+import stat
+import threading
+import time
+
+import cv2
+import numpy as np
+
+import v4l2
+from utils import FrameRing, reuse_buffer
+
+
+class Sink:
+    """An output of the camera that writes frames on its own thread.
+
+    Frames wait in a bounded FrameRing. When it is full, drop="oldest" discards the oldest waiting
+    frame, which suits live outputs, and drop="newest" the incoming one. Either way a slow sink
+    loses frames instead of stalling the pipeline.
+    """
+    name = "sink"
+
+    def __init__(self, capacity=1, drop="oldest"):
+        self.capacity = capacity
+        self.drop = drop
+        self.ring = None
+        self.thread = None
+        self.on_done = None
+        self.stats = None
+
+    def start(self, on_done=None, stats=None):
+        # on_done(timed_frame) is called once a frame is written or dropped
+        self.on_done = on_done
+        self.stats = stats
+        self.ring = FrameRing(self.capacity, on_drop=self.done, drop=self.drop)
+        self.thread = threading.Thread(target=self.run, name=f"cow-sink-{self.name}")
+        self.thread.start()
+
+    def put(self, timed_frame):
+        self.ring.put(timed_frame)
+
+    def run(self):
+        while True:
+            timed_frame = self.ring.get()
+            if timed_frame is None:  # Closed and drained
+                return
+            start = time.perf_counter()
+            try:
+                self.write(timed_frame.frame)
+            except Exception as e:
+                print(e)
+            if self.stats is not None:
+                self.stats.record("sinks", self.name, time.perf_counter() - start)
+                if timed_frame.timestamp is not None:  # None for frames not from the capture, like a plugin's
+                    self.stats.record("latency", f"capture to {self.name}", time.monotonic() - timed_frame.timestamp)
+            self.done(timed_frame)
+
+    def done(self, timed_frame):
+        if self.on_done is not None:
+            self.on_done(timed_frame)
+
+    def stop(self):
+        # Writes the frames still waiting, then closes the sink
+        if self.thread is not None:
+            self.ring.close()
+            self.thread.join()
+            self.thread = None
+        self.close()
+
+    def write(self, frame):
+        raise NotImplementedError()
+
+    def close(self):
+        pass
+
+
+class SinkGroup:
+    """Fans every frame out to several sinks.
+
+    The sinks share the frame without copies, and it goes back to the pool via release once
+    every sink has written or dropped it.
+    """
+
+    def __init__(self, release=None, stats=None):
+        self.release = release
+        self.stats = stats
+        self.sinks = []
+        self.refs = {}
+        self.lock = threading.Lock()
+
+    def add(self, sink):
+        sink.start(self.done, self.stats)
+        with self.lock:
+            self.sinks = self.sinks + [sink]
+        return sink
+
+    def remove(self, sink):
+        with self.lock:
+            if sink not in self.sinks:
+                return
+            self.sinks = [s for s in self.sinks if s is not sink]
+        sink.stop()
+
+    def put(self, timed_frame):
+        sinks = self.sinks
+        if not sinks:
+            self.release_frame(timed_frame)
+            return
+        with self.lock:
+            self.refs[id(timed_frame.frame)] = len(sinks)
+        for sink in sinks:
+            sink.put(timed_frame)
+
+    def done(self, timed_frame):
+        key = id(timed_frame.frame)
+        with self.lock:
+            self.refs[key] -= 1
+            if self.refs[key] > 0:
+                return
+            del self.refs[key]
+        self.release_frame(timed_frame)
+
+    def release_frame(self, timed_frame):
+        if self.release is not None:
+            self.release(timed_frame.frame)
+
+    def dropped(self):
+        return {sink.name: sink.ring.dropped for sink in self.sinks}
+
+    def close(self):
+        for sink in list(self.sinks):
+            self.remove(sink)
+
+
+class LoopbackWriter(Sink):
+    """Writes RGB frames to a v4l2loopback device.
+
+    The pixel format is negotiated with the device in order of preference and every frame is
+    converted into the same preallocated buffer. YU12 takes one cvtColor call, and so does YUYV on
+    OpenCV builds with COLOR_RGB2YUV_YUYV (not 3.4). Elsewhere YUYV and NV12 are repacked from the
+    I420 planes, which costs a few more passes over the frame. Any regular file or pipe can stand
+    in for the device, in which case the first preferred format is used.
+    """
+    name = "loopback"
+    # Formats OpenCV converts to in a single call first
+    formats = ("YUYV", "YU12", "NV12", "MJPG") if hasattr(cv2, "COLOR_RGB2YUV_YUYV") else \
+        ("YU12", "YUYV", "NV12", "MJPG")
+
+    def __init__(self, path, width, height, formats=formats, capacity=1):
+        super().__init__(capacity)
+        self.width = width
+        self.height = height
+        self.scratch = None
+        self.fd = os.open(path, os.O_WRONLY)
+        try:
+            self.pixel_format = self.negotiate(formats)
+        except Exception:
+            os.close(self.fd)
+            raise
+        self.buffer = None
+        if self.pixel_format == "YUYV":
+            self.buffer = np.empty((height, width, 2), np.uint8)
+        elif self.pixel_format in ("YU12", "NV12"):
+            self.buffer = np.empty((height * 3 // 2, width), np.uint8)
+
+    def format_sizes(self, pixel_format):
+        # (bytes per line, image size) as expected by VIDIOC_S_FMT
+        w, h = self.width, self.height
+        if pixel_format == "YUYV":
+            return w * 2, w * h * 2
+        if pixel_format in ("YU12", "NV12"):
+            return w, w * h * 3 // 2
+        return 0, w * h * 2  # Upper bound for a compressed frame
+
+    def negotiate(self, formats):
+        if not stat.S_ISCHR(os.fstat(self.fd).st_mode):
+            return formats[0]
+        for pixel_format in formats:
+            try:
+                accepted = v4l2.set_format(self.fd, self.width, self.height, pixel_format,
+                                           *self.format_sizes(pixel_format))
+            except OSError:
+                continue
+            if accepted["pixel_format"] == pixel_format and \
+                    (accepted["width"], accepted["height"]) == (self.width, self.height):
+                return pixel_format
+        raise RuntimeError(f"Output device accepts none of {formats} at {self.width}x{self.height}")
+
+    def planar_yuv(self, frame):
+        # BT.601 I420 planes, shared by the formats OpenCV cannot produce directly
+        w, h = self.width, self.height
+        self.scratch = cv2.cvtColor(frame, cv2.COLOR_RGB2YUV_I420, dst=reuse_buffer(self.scratch, (h * 3 // 2, w)))
+        planes = self.scratch.reshape(-1)
+        u = planes[w * h:w * h * 5 // 4].reshape(h // 2, w // 2)
+        v = planes[w * h * 5 // 4:].reshape(h // 2, w // 2)
+        return self.scratch[:h], u, v
+
+    def convert(self, frame):
+        if self.pixel_format == "YU12":
+            return cv2.cvtColor(frame, cv2.COLOR_RGB2YUV_I420, dst=self.buffer)
+        if self.pixel_format == "YUYV" and hasattr(cv2, "COLOR_RGB2YUV_YUYV"):
+            return cv2.cvtColor(frame, cv2.COLOR_RGB2YUV_YUYV, dst=self.buffer)
+        if self.pixel_format == "MJPG":
+            self.scratch = cv2.cvtColor(frame, cv2.COLOR_RGB2BGR, dst=reuse_buffer(self.scratch, frame.shape))
+            return cv2.imencode(".jpg", self.scratch)[1]
+        y, u, v = self.planar_yuv(frame)
+        if self.pixel_format == "NV12":
+            self.buffer[:self.height] = y
+            uv = self.buffer.reshape(-1)[self.width * self.height:].reshape(self.height // 2, self.width // 2, 2)
+            uv[..., 0] = u
+            uv[..., 1] = v
+        else:  # YUYV packed from the I420 planes
+            self.buffer[..., 0] = y
+            for row in (0, 1):
+                self.buffer[row::2, 0::2, 1] = u
+                self.buffer[row::2, 1::2, 1] = v
+        return self.buffer
+
+    def write(self, frame):
+        data = memoryview(self.convert(frame)).cast("B")
+        while len(data):  # Pipes may accept partial writes
+            written = os.write(self.fd, data)
+            data = data[written:]
+
+    def close(self):
+        os.close(self.fd)
+
+
+class PreviewChannel(Sink):
+    """Hands the latest output frame to an in-process viewer, triple buffered.
+
+    write copies the frame (downscaled to max_width and optionally mirrored) into a back
+    buffer. take returns the newest frame, which the viewer may use without copying until its
+    next take. While paused, write does nothing.
+    """
+    name = "preview"
+
+    def __init__(self, max_width=None, mirror=False):
+        super().__init__()
+        self.max_width = max_width
+        self.mirror = mirror
+        self.paused = True
+        self.on_frame = None  # Called by write when a frame becomes available after a take
+        self.lock = threading.Lock()
+        self.back = self.ready = self.front = None
+        self.fresh = False
+        self.scaled = None
+
+    def write(self, frame):
+        if self.paused:
+            return
+        height, width = frame.shape[:2]
+        if self.max_width is not None and width > self.max_width:
+            height, width = height * self.max_width // width, self.max_width
+        back = reuse_buffer(self.back, (height, width) + frame.shape[2:])
+        if (height, width) != frame.shape[:2]:
+            target = reuse_buffer(self.scaled, back.shape) if self.mirror else back
+            frame = self.scaled = cv2.resize(frame, (width, height), dst=target, interpolation=cv2.INTER_AREA)
+        if self.mirror:
+            cv2.flip(frame, 1, dst=back)
+        elif frame is not back:
+            np.copyto(back, frame)
+        with self.lock:
+            notify = not self.fresh
+            self.back, self.ready = self.ready, back
+            self.fresh = True
+        if notify and self.on_frame is not None:
+            self.on_frame()
+
+    def take(self):
+        # The newest frame, or None if there is none since the last take
+        with self.lock:
+            if not self.fresh:
+                return None
+            self.front, self.ready = self.ready, self.front
+            self.fresh = False
+            return self.front
+
+
+class VideoFileSink(Sink):
+    """Encodes frames into a video file. Waits for up to a second of frames before dropping any."""
+    name = "file"
+
+    def __init__(self, path, width, height, fps=30, fourcc="mp4v", mirror=False, capacity=30):
+        super().__init__(capacity, drop="newest")
+        self.path = str(path)
+        self.mirror = mirror
+        self.writer = cv2.VideoWriter(self.path, cv2.VideoWriter_fourcc(*fourcc), fps, (width, height))
+        self.bgr = None
+
+    def write(self, frame):
+        self.bgr = cv2.cvtColor(frame, cv2.COLOR_RGB2BGR, dst=reuse_buffer(self.bgr, frame.shape))
+        if self.mirror:
+            cv2.flip(self.bgr, 1, dst=self.bgr)
+        self.writer.write(self.bgr)
+
+    def close(self):
+        self.writer.release()
+
+
+def map_shared_memory(name, size=None):
+    # POSIX shared memory block /dev/shm/name, created with size if given. multiprocessing.shared_memory
+    # would do the same, but only exists from Python 3.8.
+    path = os.path.join("/dev/shm", name)
+    if size is not None:
+        try:
+            os.unlink(path)  # Left over by a run that did not close its sink, e.g. after a crash
+        except FileNotFoundError:
+            pass
+    flags = os.O_RDWR if size is None else os.O_RDWR | os.O_CREAT | os.O_EXCL
+    fd = os.open(path, flags, 0o600)
+    try:
+        if size is not None:
+            os.ftruncate(fd, size)
+        return mmap.mmap(fd, size or 0)
+    finally:
+        os.close(fd)
+
+
+class SharedMemorySink(Sink):
+    """Publishes frames to other processes through a ring of slots in shared memory.
+
+    The block starts with a header of uint64 values: the sequence number of the latest frame,
+    height, width, channels and number of slots, followed by the sequence number of the frame in
+    each slot (0 while it is written) and then the slots. Read it with SharedMemoryReader.
+    """
+    name = "shm"
+    header_size = 5
+
+    def __init__(self, name, width, height, channels=3, slots=3):
+        super().__init__()
+        self.shape = (height, width, channels)
+        self.slots = slots
+        frame_size = height * width * channels
+        self.path = os.path.join("/dev/shm", name)
+        self.memory = map_shared_memory(name, 8 * (self.header_size + slots) + slots * frame_size)
+        self.header = np.ndarray((self.header_size + slots,), np.uint64, self.memory)
+        self.header[:] = 0
+        self.header[1:self.header_size] = (height, width, channels, slots)
+        self.frames = np.ndarray((slots,) + self.shape, np.uint8, self.memory, offset=self.header.nbytes)
+        self.seq = 0
+
+    def write(self, frame):
+        self.seq += 1
+        slot = self.seq % self.slots
+        self.header[self.header_size + slot] = 0
+        np.copyto(self.frames[slot], frame)
+        self.header[self.header_size + slot] = self.seq
+        self.header[0] = self.seq
+
+    def close(self):
+        del self.header, self.frames
+        self.memory.close()
+        os.unlink(self.path)
+
+
+class SharedMemoryReader:
+    """Reads the latest frame published by a SharedMemorySink of the given name."""
+
+    def __init__(self, name):
+        self.memory = map_shared_memory(name)
+        header_size = SharedMemorySink.header_size
+        height, width, channels, slots = np.ndarray((header_size,), np.uint64, self.memory)[1:].tolist()
+        self.header = np.ndarray((header_size + slots,), np.uint64, self.memory)
+        self.frames = np.ndarray((slots, height, width, channels), np.uint8, self.memory,
+                                 offset=self.header.nbytes)
+        self.slot_seqs = self.header[header_size:]
+
+    def read(self, out=None, retries=3):
+        # Returns (sequence number, frame) or None if there is no frame yet or the writer kept overtaking
+        for _ in range(retries):
+            seq = int(self.header[0])
+            if seq == 0:
+                return None
+            slot = seq % len(self.frames)
+            out = reuse_buffer(out, self.frames.shape[1:])
+            np.copyto(out, self.frames[slot])
+            if int(self.slot_seqs[slot]) == seq:
+                return seq, out
+        return None
+
+    def close(self):
+        del self.header, self.frames, self.slot_seqs
+        self.memory.close()
+
+
+class MjpegServer(socketserver.ThreadingTCPServer):
+    allow_reuse_address = True  # A restart need not wait for the connections of the last run to time out
+    daemon_threads = True
+
+
+class MjpegHttpSink(Sink):
+    """Serves the frames as a multipart MJPEG stream, e.g. for a browser preview.
+
+    Frames are only encoded while at least one client is connected.
+    """
+    name = "mjpeg"
+    boundary = "cowframe"
+
+    def __init__(self, port=8090, host="127.0.0.1", quality=80):
+        super().__init__()
+        self.quality = quality
+        self.jpeg = None
+        self.seq = 0
+        self.clients = 0
+        self.closed = False
+        self.condition = threading.Condition()
+        self.bgr = None
+        self.server = MjpegServer((host, port), self.make_handler())
+        self.server_thread = threading.Thread(target=self.server.serve_forever, name="cow-mjpeg", daemon=True)
+        self.server_thread.start()
+
+    def make_handler(self):
+        sink = self
+
+        class Handler(http.server.BaseHTTPRequestHandler):
+            def do_GET(self):
+                self.send_response(200)
+                self.send_header("Cache-Control", "no-cache")
+                self.send_header("Content-Type", f"multipart/x-mixed-replace; boundary={sink.boundary}")
+                self.end_headers()
+                with sink.condition:
+                    sink.clients += 1
+                try:
+                    sink.stream(self.wfile)
+                except (BrokenPipeError, ConnectionResetError):
+                    pass
+                finally:
+                    with sink.condition:
+                        sink.clients -= 1
+
+            def log_message(self, *args):
+                pass
+        return Handler
+
+    def stream(self, wfile):
+        seq = self.seq
+        while True:
+            with self.condition:
+                self.condition.wait_for(lambda: self.seq != seq or self.closed)
+                if self.closed:
+                    return
+                seq, jpeg = self.seq, self.jpeg
+            wfile.write(f"--{self.boundary}\r\nContent-Type: image/jpeg\r\n"
+                        f"Content-Length: {len(jpeg)}\r\n\r\n".encode())
+            wfile.write(jpeg)
+            wfile.write(b"\r\n")
+
+    def write(self, frame):
+        if not self.clients:
+            return
+        self.bgr = cv2.cvtColor(frame, cv2.COLOR_RGB2BGR, dst=reuse_buffer(self.bgr, frame.shape))
+        jpeg = cv2.imencode(".jpg", self.bgr, (cv2.IMWRITE_JPEG_QUALITY, self.quality))[1].tobytes()
+        with self.condition:
+            self.jpeg = jpeg
+            self.seq += 1
+            self.condition.notify_all()
+
+    def close(self):
+        with self.condition:
+            self.closed = True
+            self.condition.notify_all()
+        self.server.shutdown()
+        self.server.server_close()
+
+
+class NullSink(Sink):
+    """Discards the frames, for running the pipeline without any output device."""
+    name = "null"
+
+    def write(self, frame):
+        pass
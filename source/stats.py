@@ -0,0 +1,59 @@
+import threading
+from collections import OrderedDict, deque
+
+import numpy as np
+
+
+class RollingHistogram:
+    """Keeps the most recent samples and reports percentiles over them."""
+
+    def __init__(self, window=300):
+        self.samples = deque(maxlen=window)
+        self.count = 0
+        self.lock = threading.Lock()
+
+    def add(self, value):
+        with self.lock:
+            self.samples.append(value)
+            self.count += 1
+
+    def percentiles(self, qs=(50, 95, 99)):
+        with self.lock:
+            samples = list(self.samples)
+        if not samples:
+            return {f"p{q}": None for q in qs}
+        values = np.percentile(samples, qs)
+        return {f"p{q}": float(v) for q, v in zip(qs, values)}
+
+
+class PipelineStats:
+    """Rolling timings in milliseconds, grouped by section (e.g. "stages" and "plugins")."""
+
+    def __init__(self, window=300):
+        self.window = window
+        self.sections = OrderedDict()
+        self.lock = threading.Lock()
+
+    def histogram(self, section, name):
+        with self.lock:
+            histograms = self.sections.setdefault(section, OrderedDict())
+            if name not in histograms:
+                histograms[name] = RollingHistogram(self.window)
+            return histograms[name]
+
+    def record(self, section, name, seconds):
+        self.histogram(section, name).add(seconds * 1000)
+
+    def summary(self):
+        with self.lock:
+            sections = [(section, list(histograms.items())) for section, histograms in self.sections.items()]
+        summary = OrderedDict()
+        for section, histograms in sections:
+            summary[section] = OrderedDict()
+            for name, histogram in histograms:
+                summary[section][name] = dict(histogram.percentiles(), count=histogram.count)
+        return summary
+
+    def reset(self):
+        with self.lock:
+            self.sections = OrderedDict()
@@ -0,0 +1,13 @@
+import os
+import sys
+
+import pytest
+
+SOURCE = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+sys.path.insert(0, SOURCE)
+
+
+@pytest.fixture(autouse=True)
+def in_source(monkeypatch):
+    # Plugins read and write their data relative to the source directory, like when run from it
+    monkeypatch.chdir(SOURCE)
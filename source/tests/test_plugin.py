@@ -0,0 +1,25 @@
+import numpy as np
+
+from plugin import make_chain_process, Plugin
+from utils import FramePool
+
+
+class CopyingPlugin(Plugin):
+    # The plain contract: process returns a new frame
+    def __init__(self):
+        super().__init__("Copying", "Test")
+
+    def process(self, frame):
+        return frame + 1
+
+
+def test_chain_releases_frames_replaced_by_process():
+    pool = FramePool()
+    chain = make_chain_process([CopyingPlugin(), CopyingPlugin()], pool)
+    for _ in range(50):
+        frame = pool.acquire((48, 64, 3))
+        frame[:] = 0
+        out = chain(frame)
+        assert (out == 2).all()
+        pool.release(out)
+    assert len(pool.owned) <= 1
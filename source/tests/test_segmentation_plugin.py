@@ -0,0 +1,28 @@
+import threading
+
+import numpy as np
+
+from plugins.segmentation_plugin.segmentation_plugin import SegmentationPlugin
+
+
+class BlockedBackend:
+    # Stands in for a model that is still loading
+    def __init__(self):
+        self.release = threading.Event()
+
+    def __call__(self, image):
+        self.release.wait()
+        return np.ones(image.shape[:2], np.float32)
+
+
+def test_frames_pass_through_until_the_first_mask():
+    plugin = SegmentationPlugin()
+    plugin.display.set(True)
+    backend = plugin.backend = BlockedBackend()
+    plugin.backend_config = plugin.get_backend_config()
+    frame = np.random.randint(0, 255, (240, 320, 3), np.uint8)
+    try:
+        for _ in range(3):
+            assert np.array_equal(plugin.process(frame.copy()), frame)
+    finally:
+        backend.release.set()
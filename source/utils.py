@@ -1,7 +1,10 @@
 import glob
 import os
+import threading
+from collections import deque, namedtuple
 
-from PyQt5 import QtWidgets, QtCore
+import cv2
+import numpy as np
 
 
 def crop_center(img, crop_height, crop_width):
@@ -13,6 +16,15 @@ def crop_center(img, crop_height, crop_width):
            width_margin:width_margin+crop_width]
 
 
+def cover_fit(img, width, height, dst=None):
+    # Scales img to cover width x height, cropping what overflows on either side
+    img_height, img_width = img.shape[:2]
+    scale = max(width / img_width, height / img_height)
+    crop = crop_center(img, min(img_height, round(height / scale)), min(img_width, round(width / scale)))
+    interpolation = cv2.INTER_AREA if scale < 1 else cv2.INTER_LINEAR
+    return cv2.resize(crop, (width, height), dst=dst, interpolation=interpolation)
+
+
 def get_latest_file(dir_path, ext_fmt="*"):
     list_of_files = glob.glob(os.path.join(dir_path, ext_fmt))
     if len(list_of_files):
@@ -41,30 +53,119 @@ class ObservableValue:
         self.observers.remove(observer)
 
 
+# A frame with its capture sequence number and capture time (seconds on the monotonic clock)
+TimedFrame = namedtuple("TimedFrame", ["frame", "seq", "timestamp"])
+
+
+class FrameRing:
+    """Bounded frame buffer between two pipeline stages.
+
+    When the ring is full the oldest frame is dropped, so the consumer always
+    gets the most recent frames and never falls behind the producer. With
+    drop="newest" the incoming frame is dropped instead.
+    """
+
+    def __init__(self, capacity=1, on_drop=None, drop="oldest"):
+        self.capacity = capacity
+        self.on_drop = on_drop
+        self.drop = drop
+        self.dropped = 0
+        self.closed = False
+        self.frames = deque()
+        self.condition = threading.Condition()
+
+    def put(self, frame):
+        # Frames put after close are dropped
+        with self.condition:
+            if self.closed or (self.drop == "newest" and len(self.frames) >= self.capacity):
+                self.dropped += 1
+                if self.on_drop is not None:
+                    self.on_drop(frame)
+                return
+            if len(self.frames) >= self.capacity:
+                stale = self.frames.popleft()
+                self.dropped += 1
+                if self.on_drop is not None:
+                    self.on_drop(stale)
+            self.frames.append(frame)
+            self.condition.notify()
+
+    def get(self, timeout=None):
+        # Returns None on timeout or once the ring is closed and drained
+        with self.condition:
+            self.condition.wait_for(lambda: self.frames or self.closed, timeout)
+            if not self.frames:
+                return None
+            return self.frames.popleft()
+
+    def close(self):
+        with self.condition:
+            self.closed = True
+            self.condition.notify_all()
+
+
+class FramePool:
+    """Reusable frame buffers grouped by shape and dtype.
+
+    Only buffers created by the pool are taken back by release, so it is safe
+    to release any frame, including ones a plugin allocated by itself.
+    """
+
+    def __init__(self):
+        self.free = {}
+        self.owned = {}
+        self.free_ids = set()
+        self.lock = threading.Lock()
+
+    @staticmethod
+    def key(shape, dtype):
+        return tuple(shape), np.dtype(dtype).str
+
+    def acquire(self, shape, dtype=np.uint8):
+        with self.lock:
+            buffers = self.free.get(self.key(shape, dtype))
+            if buffers:
+                buffer = buffers.pop()
+                self.free_ids.discard(id(buffer))
+                return buffer
+            buffer = np.empty(shape, dtype)
+            self.owned[id(buffer)] = buffer
+            return buffer
+
+    def acquire_like(self, frame):
+        return self.acquire(frame.shape, frame.dtype)
+
+    def owns(self, buffer):
+        with self.lock:
+            return self.owned.get(id(buffer)) is buffer
+
+    def release(self, buffer):
+        if buffer is None:
+            return
+        with self.lock:
+            if self.owned.get(id(buffer)) is not buffer or id(buffer) in self.free_ids:
+                return
+            self.free_ids.add(id(buffer))
+            self.free.setdefault(self.key(buffer.shape, buffer.dtype), []).append(buffer)
+
+    def clear(self):
+        # Buffers still in flight are simply forgotten and collected once unused
+        with self.lock:
+            self.free = {}
+            self.owned = {}
+            self.free_ids = set()
+
+
+def reuse_buffer(buffer, shape, dtype=np.uint8):
+    # Returns buffer if it already has the requested layout, a new array otherwise
+    if buffer is None or buffer.shape != tuple(shape) or buffer.dtype != dtype:
+        return np.empty(shape, dtype)
+    return buffer
+
+
 class ToggleLink(ObservableValue):
     def __init__(self):
         super(ToggleLink, self).__init__(False)
 
     def flip(self):
         self.set(not self.get())
-
-
-def create_adjustment_slider(mini, maxi, step=1):
-    slider = QtWidgets.QSlider()
-    slider.setEnabled(True)
-    slider.setMinimum(mini)
-    slider.setMaximum(maxi)
-    slider.setTracking(True)
-    slider.setOrientation(QtCore.Qt.Horizontal)
-    slider.setTickInterval(step)
-    slider.setSingleStep(step)
-    if step != 1:
-        def reposition():
-            val = slider.value()
-            if (val - mini) % step != 0:
-                val += step - (val - mini) % step
-            slider.setValue(val)
-
-        slider.valueChanged.connect(reposition)
-    slider.setTickPosition(QtWidgets.QSlider.TickPosition(2))
-    return slider
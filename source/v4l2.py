@@ -0,0 +1,108 @@
+import fcntl
+import struct
+
+V4L2_BUF_TYPE_VIDEO_CAPTURE = 1
+V4L2_BUF_TYPE_VIDEO_OUTPUT = 2
+V4L2_FIELD_NONE = 1
+V4L2_COLORSPACE_SRGB = 8
+V4L2_CAP_VIDEO_CAPTURE = 0x1
+V4L2_CAP_DEVICE_CAPS = 0x80000000
+V4L2_FRMSIZE_TYPE_DISCRETE = 1
+V4L2_FRMSIZE_TYPE_CONTINUOUS = 2
+V4L2_FRMSIZE_TYPE_STEPWISE = 3
+
+# struct v4l2_format: u32 type, padding, then a 200 byte union starting with struct v4l2_pix_format
+FORMAT_STRUCT = struct.Struct("=I4x12I152x")
+# struct v4l2_capability: driver, card, bus_info, version, capabilities, device_caps, reserved
+CAPABILITY_STRUCT = struct.Struct("=16s32s32s3I12x")
+# struct v4l2_fmtdesc: index, type, flags, description, pixelformat, mbus_code, reserved
+FMTDESC_STRUCT = struct.Struct("=3I32s2I12x")
+# struct v4l2_frmsizeenum: index, pixel_format, type, then discrete (width, height) or stepwise
+# (min_width, max_width, step_width, min_height, max_height, step_height), reserved
+FRMSIZE_STRUCT = struct.Struct("=3I6I8x")
+
+
+def _ior(nr, size):
+    return (2 << 30) | (size << 16) | (ord("V") << 8) | nr
+
+
+def _iowr(nr, size):
+    return (3 << 30) | (size << 16) | (ord("V") << 8) | nr
+
+
+VIDIOC_QUERYCAP = _ior(0, CAPABILITY_STRUCT.size)
+VIDIOC_ENUM_FMT = _iowr(2, FMTDESC_STRUCT.size)
+VIDIOC_G_FMT = _iowr(4, FORMAT_STRUCT.size)
+VIDIOC_S_FMT = _iowr(5, FORMAT_STRUCT.size)
+VIDIOC_ENUM_FRAMESIZES = _iowr(74, FRMSIZE_STRUCT.size)
+
+
+def fourcc(code):
+    return ord(code[0]) | (ord(code[1]) << 8) | (ord(code[2]) << 16) | (ord(code[3]) << 24)
+
+
+def fourcc_code(value):
+    return "".join(chr((value >> shift) & 0xFF) for shift in (0, 8, 16, 24))
+
+
+def unpack_format(data):
+    values = FORMAT_STRUCT.unpack(data)
+    return {"type": values[0], "width": values[1], "height": values[2], "pixel_format": fourcc_code(values[3]),
+            "field": values[4], "bytes_per_line": values[5], "size_image": values[6]}
+
+
+def get_format(fd, buf_type=V4L2_BUF_TYPE_VIDEO_OUTPUT):
+    request = bytearray(FORMAT_STRUCT.pack(buf_type, *[0] * 12))
+    fcntl.ioctl(fd, VIDIOC_G_FMT, request)
+    return unpack_format(request)
+
+
+def set_format(fd, width, height, pixel_format, bytes_per_line, size_image, buf_type=V4L2_BUF_TYPE_VIDEO_OUTPUT):
+    # Raises OSError if the driver rejects the request
+    request = bytearray(FORMAT_STRUCT.pack(buf_type, width, height, fourcc(pixel_format), V4L2_FIELD_NONE,
+                                           bytes_per_line, size_image, V4L2_COLORSPACE_SRGB, 0, 0, 0, 0, 0))
+    fcntl.ioctl(fd, VIDIOC_S_FMT, request)
+    return unpack_format(request)
+
+
+def _string(data):
+    return data.split(b"\0", 1)[0].decode(errors="replace")
+
+
+def query_capabilities(fd):
+    request = bytearray(CAPABILITY_STRUCT.size)
+    fcntl.ioctl(fd, VIDIOC_QUERYCAP, request)
+    driver, card, bus_info, version, capabilities, device_caps = CAPABILITY_STRUCT.unpack(request)
+    if not capabilities & V4L2_CAP_DEVICE_CAPS:
+        device_caps = capabilities
+    return {"driver": _string(driver), "card": _string(card), "bus_info": _string(bus_info),
+            "capabilities": capabilities, "device_caps": device_caps}
+
+
+def enum_formats(fd, buf_type=V4L2_BUF_TYPE_VIDEO_CAPTURE):
+    # Pixel formats of the device as fourcc strings. The driver signals the end of the list with EINVAL.
+    formats = []
+    while True:
+        request = bytearray(FMTDESC_STRUCT.pack(len(formats), buf_type, 0, b"", 0, 0))
+        try:
+            fcntl.ioctl(fd, VIDIOC_ENUM_FMT, request)
+        except OSError:
+            return formats
+        formats.append(fourcc_code(FMTDESC_STRUCT.unpack(request)[4]))
+
+
+def enum_frame_sizes(fd, pixel_format):
+    # Discrete sizes as {"width", "height"}, or a single range with min/max/step of both sides
+    sizes = []
+    while True:
+        request = bytearray(FRMSIZE_STRUCT.pack(len(sizes), fourcc(pixel_format), *[0] * 7))
+        try:
+            fcntl.ioctl(fd, VIDIOC_ENUM_FRAMESIZES, request)
+        except OSError:
+            return sizes
+        values = FRMSIZE_STRUCT.unpack(request)
+        if values[2] == V4L2_FRMSIZE_TYPE_DISCRETE:
+            sizes.append({"type": values[2], "width": values[3], "height": values[4]})
+        else:
+            return [{"type": values[2], "min_width": values[3], "max_width": values[4], "step_width": values[5],
+                     "min_height": values[6], "max_height": values[7], "step_height": values[8]}]